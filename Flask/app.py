@@ -1,38 +1,183 @@
+import os
+import secrets
+from datetime import datetime
 from pathlib import Path
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
+from markupsafe import Markup
 from database import db
-from models import Product, Order, ProductsOrder
+from models import Product, Order, ORDER_COLUMNS, ORDER_FIELDS, catalog_version
+from changes import changes_since, stream_changes
+from search import product_index
+from caching import catalog_cache
+from compression import choose_encoding, compress
+from ratelimit import FileSlots, limiter
+from groupcommit import group_commit, succeeded
+import writes
+from replica import replica
+from inventory import movements, stock_at, take_snapshot
+from quotes import load_quote, quote_cart
 from sqlalchemy import asc
+from sqlalchemy.orm import load_only, selectinload
 
 
 app = Flask(__name__)
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///store.db"
 app.instance_path = Path(".").resolve()
+app.config["MAX_PER_PAGE"] = 200
+app.config["CATALOG_PER_PAGE"] = 50
+app.config["COMPRESS_MIN_SIZE"] = 500     # bytes, smaller responses are sent as they are
+app.config["REPLICA_MODE"] = os.environ.get("REPLICA_MODE", "off")     # 'off', 'wal' or 'copy', see replica.py
+app.config["CHANGES_POLL_INTERVAL"] = 0.5     # seconds between the checks of the SSE stream
+app.config["CHANGES_STREAM_MAX_AGE"] = 20     # seconds, below the gunicorn timeout, clients reconnect after
+# open SSE streams on the whole server, each one takes a sync worker (or a thread with gthread)
+app.config["CHANGES_MAX_STREAMS"] = int(os.environ.get("CHANGES_MAX_STREAMS", 2))
+app.config["SEARCH_SYNC_INTERVAL"] = 1.0      # seconds between the catch ups of the search index with other workers
+app.config["REPLICA_MAX_STALENESS"] = float(os.environ.get("REPLICA_MAX_STALENESS", 2.0))
+app.config["WRITE_MAX_INFLIGHT"] = int(os.environ.get("WRITE_MAX_INFLIGHT", 8))   # writes running at once on the whole server, see ratelimit.py
+app.config["GROUP_COMMIT"] = os.environ.get("GROUP_COMMIT", "0") == "1"     # share one commit between concurrent writes, see groupcommit.py
+app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "FULL")  # EXTRA, FULL, NORMAL or OFF, see database.py
+app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY") or secrets.token_hex(32)    # signs the order quotes
+app.config["QUOTE_MAX_AGE"] = 300     # seconds an order quote can be submitted for
 db.init_app(app)
+limiter.init_app(app)
+replica.init_app(app)
+group_commit.init_app(app)
+stream_slots = FileSlots(os.path.join(app.instance_path, '.stream-slots'))
+
+
+@app.after_request
+def compress_response(response):
+    """Compresses JSON responses above COMPRESS_MIN_SIZE with the best encoding the client accepts"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+@app.errorhandler(InvalidFields)
+def handle_invalid_fields(error):
+    return str(error), 400
+
+
+def order_query():
+    """Returns a query for orders that only loads what the ?fields= argument of
+    the request asks for, the products are fetched in one extra query for all
+    the orders instead of one per order
+
+    Returns:
+        tuple: the query and the fields to pass to Order.to_dict
+    """
+    fields = request.args.get('fields')
+    if not fields:
+        fields = ORDER_FIELDS
+    else:
+        fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+        unknown = [field for field in fields if field not in ORDER_FIELDS]
+        if unknown:
+            raise InvalidFields(f"Unknown fields: {', '.join(unknown)}, valid fields are: {', '.join(ORDER_FIELDS)}")
+    columns = [getattr(Order, ORDER_COLUMNS[field]) for field in fields if field in ORDER_COLUMNS]
+    query = replica.query(Order).options(load_only(Order.id, *columns))
+    if 'price' in fields:
+        query = query.options(load_only(Order.total))   # orders not backfilled yet load their products lazily
+    if 'products' in fields:
+        query = query.options(selectinload(Order.products))
+    return query, fields
+
+
+def paginate(query):
+    """Applies the optional ?page=&per_page= arguments of the request to query,
+    without them all the rows are returned like before
+
+    Args:
+        query (Query): an ordered query
+
+    Returns:
+        tuple: rows of the page, total number of rows and the paging headers for the response
+    """
+    page = request.args.get('page', type=int)
+    if page is None:
+        items = query.all()
+        return items, len(items), {}
+    page = max(page, 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), app.config["MAX_PER_PAGE"])
+    total = query.order_by(None).count()
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    return items, total, {'X-Total-Count': total, 'X-Page': page, 'X-Per-Page': per_page}
 
 
 @app.route("/")
 def home():
-    data = Product.query.all()
-    return render_template("index.html", products=data)
+    page = max(request.args.get('page', 1, type=int), 1)
+    version = catalog_version(replica.session())
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    # a strong validator is different for every content coding of the page
+    etag = f'catalog-{version}-{page}-{encoding or "identity"}'
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding'}
+    # the compressed page is cached as a whole, built from the cached fragments below
+    body = catalog_cache.get_or_render(('page', version, page, encoding),
+                                       lambda: compress(render_catalog(version, page).encode(), encoding))
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def render_catalog(version, page):
+    """Renders the storefront page, the product table and the page links are
+    cached separately for the given catalog version
+    """
+    per_page = app.config["CATALOG_PER_PAGE"]
+    total = catalog_cache.get_or_render(('count', version), lambda: replica.query(Product).count())
+    page_count = max((total + per_page - 1) // per_page, 1)
+
+    def render_rows():
+        products = replica.query(Product).order_by(Product.name).limit(per_page).offset((page - 1) * per_page).all()
+        return render_template("_product_rows.html", products=products)
+
+    rows = catalog_cache.get_or_render(('rows', version, page), render_rows)
+    pagination = catalog_cache.get_or_render(('pagination', version, page), lambda: render_template(
+        "_pagination.html", page=page, page_count=page_count))
+    return render_template("index.html", rows=Markup(rows), pagination=Markup(pagination), total=total)
 
 @app.route('/view-all-products', methods=['GET'])
 def api_get_all_products():
-    products = Product.query.all()
-    if not products:
+    products, total, headers = paginate(replica.query(Product).order_by(Product.name))
+    if not total:
         return 'No products in the inventory!', 404
-    return [product.to_dict() for product in products]
+    return [product.to_dict() for product in products], 200, headers
 
 
 @app.route("/api/product/<string:name>", methods=["GET"])
 def api_get_product(name):
-    product = db.session.get(Product, name.lower())
+    product = replica.session().get(Product, name.lower())
     if not product:
         return f"{name} is not a valid product", 404
     product_json = product.to_dict()
     return jsonify(product_json)
 
 
+@app.route("/api/product/search", methods=["GET"])
+def api_search_products():
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return product_index.search(query, limit), 200
+
+
 @app.route("/api/product", methods=["POST"])
 def api_create_product():
     data = request.json
@@ -51,14 +196,10 @@ def api_create_product():
             "Invalid values: Price must be a non-negative float and quantity a non-negative integer",
             400,
         )
-    product = Product(
-        name=data["name"],
-        price=price,
-        quantity=quantity,
-    )
-    db.session.add(product)
-    db.session.commit()
-    return "Item added to the database", 200
+    result = group_commit.run(writes.create_product, data["name"], price, quantity)
+    if succeeded(result):
+        product_index.add(data["name"])
+    return result
 
 
 @app.route("/api/product/<string:name>", methods=["PUT"])
@@ -77,151 +218,141 @@ def api_update_product(name):
             "Invalid values: Price must be a non-negative float and quantity a non-negative integer",
             400,
         )
-    product = Product.query.filter(Product.name == name).first()
-    if product is None:
-        return "Product not found", 404
-    if new_price:
-        product.price = new_price
-    if new_quantity:
-        product.quantity = new_quantity
-    db.session.commit()
-    return "Item was updated", 200
+    return group_commit.run(writes.update_product, name, new_price, new_quantity)
 
 
 @app.route('/api/product/<string:name>', methods=['DELETE'])
 def api_remove_product(name):
-    product = Product.query.filter(Product.name == name).first()
-    if product is None:
-        return "Product not found", 404
-    if ProductsOrder.query.filter(ProductsOrder.product_name == name).first():
-        return "Cannot remove product since it has been ordered by customers!", 400     # referential integrity in database must be kept 
-    db.session.delete(product)
-    db.session.commit()
-    return 'Product was removed', 200
+    result = group_commit.run(writes.remove_product, name)
+    if succeeded(result):
+        product_index.remove(name)
+    return result
 
 
 @app.route('/api/product/not-in-stock', methods=['GET'])
 def api_get_not_in_products():
-    prod_list = Product.query.filter_by(quantity=0).all()
-    if not prod_list:
+    prod_list, total, headers = paginate(replica.query(Product).filter_by(quantity=0).order_by(Product.name))
+    if not total:
         return "All products are in stock!", 404
-    return [prod.to_dict() for prod in prod_list]
+    return [prod.to_dict() for prod in prod_list], 200, headers
+
+
+@app.route('/api/product/<string:name>/stock', methods=['GET'])
+def api_get_product_stock(name):
+    at = request.args.get('at')
+    try:
+        when = datetime.fromisoformat(at) if at else None
+    except ValueError:
+        return f"{at} is not a valid ISO date", 400
+    quantity = stock_at(name.lower(), when, replica.session())
+    return dict(name=name.lower(), quantity=quantity, at=when or datetime.now()), 200
+
+
+@app.route('/api/product/<string:name>/movements', methods=['GET'])
+def api_get_product_movements(name):
+    movement_list = movements(name.lower(), limit=request.args.get('limit', 100, type=int), session=replica.session())
+    if not movement_list:
+        return f"No stock movement was recorded for {name}", 404
+    return [movement.to_dict() for movement in movement_list], 200
+
+
+@app.route('/api/inventory/snapshot', methods=['POST'])
+def api_take_snapshot():
+    return dict(movement_id=group_commit.run(take_snapshot)), 200
+
+
+@app.route('/api/metrics', methods=['GET'])
+def api_get_metrics():
+    return dict(limiter.metrics(), group_commit=group_commit.metrics()), 200
+
+
+@app.route('/api/changes', methods=['GET'])
+def api_get_changes():
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+    change_list, last_seq = changes_since(since, limit)
+    return dict(changes=change_list, last_seq=last_seq, more=len(change_list) == limit), 200
+
+
+@app.route('/api/changes/stream', methods=['GET'])
+def api_stream_changes():
+    # EventSource sends Last-Event-ID on reconnection
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    slot = stream_slots.acquire_slot(app.config["CHANGES_MAX_STREAMS"])
+    if slot is None:
+        return "Too many open change streams, poll /api/changes instead", 503, {'Retry-After': str(app.config["CHANGES_STREAM_MAX_AGE"])}
+    response = Response(stream_with_context(stream_changes(since)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: stream_slots.release_slot(slot))    # also when the client goes away
+    return response
 
 
 @app.route('/api/order/<int:order_id>')
 def api_get_order(order_id):
-    order = Order.query.get(order_id)
+    query, fields = order_query()
+    order = query.filter(Order.id == order_id).first()
     if not order:
         return f"Order with id {order_id} does not exist!", 404
-    return order.to_dict(), 200
+    return order.to_dict(fields), 200
+
+
+@app.route('/api/order/quote', methods=['POST'])
+def api_quote_order():
+    return quote_cart(request.json['products'])
 
 
 @app.route('/api/order', methods=['POST'])
+@limiter.limit_writes
 def api_create_order():
     data = request.json
-    name = data['customer_name']
-    address = data['customer_address']
-    completed = data.get('completed', False)
-    products = data['products']
-    for item in products:
-        prod = item['name']
-        if not Product.query.get(item['name']):
-            return f'Product {prod} is not in the store', 404
-    order = Order(name=name, address=address, completed=completed)
-    for item in products:
-        product = Product.query.filter_by(name=item['name']).first()
-        if item['quantity'] > int(product.quantity):
-            return f"Insufficient inventory for product: {item['name']}", 400
-        prod_quant = item['quantity']
-        prod_name = item['name']
-        if (not isinstance(prod_quant, int)) or (isinstance(prod_quant, int) and int(prod_quant) < 0): 
-            return f"Invalid quantity for {prod_name}, only non-negative int values accepted", 400
-        order_product = ProductsOrder(product=product, quantity=item['quantity'])
-        order.products.append(order_product)
-    db.session.add(order)
-    db.session.commit()
-    print(f'Order id: {order.id} was added!')
-    return order.to_dict(), 200
+    return group_commit.run(writes.create_order, data['customer_name'], data['customer_address'],
+                            data.get('completed', False), data['products'], load_quote(data.get('quote_token')))
 
 
 @app.route('/api/order/process/<int:order_id>', methods=['PUT'])
+@limiter.limit_writes
 def api_process_order(order_id):
-    if not Order.query.get(order_id):
-        return "Order not found", 404
     data = request.json
     if data is None:
         return "Missing request", 400
-    order = Order.query.get(order_id)
-    if order.completed is False:
-        order.process()
-    return order.to_dict(), 200
+    return group_commit.run(writes.process_order, order_id)
 
 
 @app.route('/api/order/delete/<int:order_id>', methods=['DELETE'])
 def api_delete_order(order_id):
-    order = Order.query.get(order_id)
-    if not order:
-        return f"Order with id {order_id} does not exist!", 404
-    for item in order.products:
-        db.session.delete(item)
-    db.session.delete(order)
-    db.session.commit()
-    return f"Order with id {order_id} was successfully removed", 200
+    return group_commit.run(writes.delete_order, order_id)
 
 
 @app.route('/api/order/<int:order_id>', methods=['PUT'])
+@limiter.limit_writes
 def api_update_order(order_id):
-    if (not isinstance(order_id, int)) or (isinstance(order_id, int) and int(order) < 0): 
+    if (not isinstance(order_id, int)) or (isinstance(order_id, int) and int(order_id) < 0): 
             return f"{order_id} is not a valid order id, only non-negative int values accepted", 400
-    product_list = request.json['products']
-    if Order.query.filter_by(id=order_id).first() is None:
-        return "Order not found", 400
-    order = Order.query.filter_by(id=order_id).first()
-    for item in product_list:
-        prod_name = item['name']
-        if not Product.query.get(prod_name):
-            return f'Order not updated. Product {prod_name} is not in the database', 404
-        prod_quant = item['quantity']
-        if (not isinstance(prod_quant, int)) or (isinstance(prod_quant, int) and int(prod_quant) < 0): 
-            return f"Invalid quantity for {prod_name}, only non-negative int values accepted", 400
-        if prod_quant > Product.query.get(prod_name).quantity:
-            return f"Insufficient inventory for product: {item['name']}", 400
-        product_order = None
-        for prod in order.products:
-            if prod.product_name == prod_name:
-                product_order = prod
-                break
-        if product_order:
-            if prod_quant != 0:
-                product_order.quantity = prod_quant
-            else:
-                db.session.delete(product_order)    # remove the ProductsOrder instance 
-        else:
-            if prod_quant != 0:
-                new_products_order = ProductsOrder(product_name=prod_name, quantity=prod_quant)
-                order.products.append(new_products_order)
-    db.session.commit()
-    return order.to_dict(), 200
+    return group_commit.run(writes.update_order, order_id, request.json['products'])
 
 
 @app.route('/api/order/pending', methods=['GET'])
 def api_get_pending_orders():
-    order_list = Order.query.filter_by(completed=False).order_by(asc(Order.order_date)).all()
-    return [order.to_dict() for order in order_list], 200
+    query, fields = order_query()
+    order_list, _, headers = paginate(query.filter(Order.completed.is_(False)).order_by(asc(Order.order_date)))
+    return [order.to_dict(fields) for order in order_list], 200, headers
 
 
 @app.route('/api/order/processed', methods=['GET'])
 def api_get_processed_orders():
-    order_list = Order.query.filter_by(completed=True).all()
-    order_list.sort(key=lambda order: (order.process_date, order.order_date))
-    return [order.to_dict() for order in order_list], 200
+    query, fields = order_query()
+    order_list, _, headers = paginate(query.filter(Order.completed.is_(True)).order_by(Order.process_date, Order.order_date))
+    return [order.to_dict(fields) for order in order_list], 200, headers
 
 @app.route('/api/order/user/<string:partial_name>', methods=['GET'])
 def api_get_user_order(partial_name):
-    order_list = Order.query.filter(Order.name.like(f'%{partial_name}%')).order_by(Order.name, Order.order_date).all()
-    if not order_list:
+    query, fields = order_query()
+    order_list, total, headers = paginate(query.filter(Order.name.like(f'%{partial_name}%')).order_by(Order.name, Order.order_date))
+    if not total:
         return "No order was found!", 404
-    return [order.to_dict() for order in order_list], 200
+    return [order.to_dict(fields) for order in order_list], 200, headers
 
 
 
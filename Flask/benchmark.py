@@ -0,0 +1,377 @@
+"""Load tests for the ThriftMart API.
+
+    python benchmark.py read --product apple --duration 10
+
+The `home` test renders the storefront page in process, once with the catalog
+cache cleared before every request and once served from the cache.
+
+The `read` test starts gunicorn (see gunicorn.conf.py) with 1, 2, 4, ... workers
+up to half the cores, hammers `/api/product/<name>` from several client
+processes and prints the throughput for every worker count. The client
+processes are busy too, so the other half of the cores is left to them: with
+more workers than that, the clients and the server fight for the same cores and
+the numbers no longer show how the server scales. To measure all the cores, run
+gunicorn on its own and the test from another machine with --url. The database
+has to exist already (create_tables.py and create_products.py).
+
+The `storm` test measures the latency of the reads served by gunicorn, first
+alone and then while other clients flood POST /api/order, with the answers the
+writes got (200, 429 rate limited, 503 shed). The orders are deleted afterwards.
+
+The `orders` test places orders from concurrent threads in process, once with a
+commit per request and once with group commit (see groupcommit.py), and prints
+the orders per second of both. The orders are deleted afterwards.
+
+The `replica` test checks the staleness bound of the read replica (see
+replica.py): it starts gunicorn with REPLICA_MODE=copy and a small
+REPLICA_MAX_STALENESS, changes the price of a product a few times and checks
+that the writer, with its cookie, reads the new price right away and that a
+client without the cookie reads it within REPLICA_MAX_STALENESS. It exits with
+an error when either fails, the price is restored afterwards.
+"""
+import argparse
+import multiprocessing
+from collections import Counter
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+from requests.exceptions import ConnectionError as RequestsConnectionError
+
+
+def wait_for_server(url, timeout=15):
+    """Blocks until the server at url answers or timeout seconds have passed"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.head(url, timeout=1)
+            return True
+        except RequestsConnectionError:
+            time.sleep(0.1)
+    return False
+
+
+def start_server(workers, port, **settings):
+    """Starts gunicorn with the given number of workers and returns the process,
+    settings are passed as environment variables
+    """
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), THRIFTMART_BIND=f'127.0.0.1:{port}', **settings)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if not wait_for_server(f'http://127.0.0.1:{port}/'):
+        server.terminate()
+        raise RuntimeError('gunicorn did not start, is it installed?')
+    return server
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait()
+
+
+def client(url, duration, results):
+    """One load generating process, sends requests to url on a keep alive
+    connection for duration seconds and reports how many succeeded
+    """
+    session = requests.Session()
+    done = errors = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        response = session.get(url)
+        if response.status_code == 200:
+            done += 1
+        else:
+            errors += 1
+    results.put((done, errors))
+
+
+def run_clients(url, clients, duration):
+    """Runs clients processes against url in parallel and returns (requests/s, errors)"""
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=client, args=(url, duration, results)) for _ in range(clients)]
+    for proc in procs:
+        proc.start()
+    counts = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    done = sum(count[0] for count in counts)
+    errors = sum(count[1] for count in counts)
+    return done / duration, errors
+
+
+def worker_counts(max_workers):
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def bench_read(args):
+    if args.url:
+        url = f'{args.url.rstrip("/")}/api/product/{args.product}'
+        run_clients(url, args.clients, 1)    # warm up the server
+        throughput, errors = run_clients(url, args.clients, args.duration)
+        print(f'GET {url}, {args.duration}s, {args.clients} clients: {throughput:.0f} req/s, {errors} errors')
+        return
+    print(f'GET /api/product/{args.product}, {args.duration}s per run, {args.clients} clients per worker')
+    print(f'{"workers":>8} {"req/s":>10} {"speedup":>8} {"errors":>7}')
+    baseline = None
+    for workers in worker_counts(args.max_workers):
+        server = start_server(workers, args.port)
+        try:
+            url = f'http://127.0.0.1:{args.port}/api/product/{args.product}'
+            run_clients(url, workers, 1)    # warm up the workers
+            throughput, errors = run_clients(url, workers * args.clients, args.duration)
+        finally:
+            stop_server(server)
+        baseline = baseline or throughput
+        print(f'{workers:>8} {throughput:>10.0f} {throughput / baseline:>7.2f}x {errors:>7}')
+
+
+def latencies(call, count):
+    """Calls call count times and returns the latency of every call in ms"""
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def bench_home(args):
+    from app import app
+    from caching import catalog_cache
+
+    client = app.test_client()
+    headers = {'Accept-Encoding': args.encoding} if args.encoding else {}
+
+    def get_home():
+        response = client.get('/', headers=headers)
+        assert response.status_code == 200
+
+    def get_home_uncached():
+        catalog_cache.clear()
+        get_home()
+
+    get_home()  # warm up the templates and the database connection
+    print(f'GET / ({args.requests} requests, Accept-Encoding: {args.encoding or "none"})')
+    print(f'{"":>10} {"mean ms":>9} {"p50 ms":>9} {"p95 ms":>9}')
+    for label, call in (('uncached', get_home_uncached), ('cached', get_home)):
+        timings = sorted(latencies(call, args.requests))
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f'{label:>10} {statistics.mean(timings):>9.3f} {statistics.median(timings):>9.3f} {p95:>9.3f}')
+
+
+def read_client(url, duration, results):
+    """Sends GET requests to url for duration seconds and reports their latencies in ms"""
+    session = requests.Session()
+    timings = []
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        start = time.perf_counter()
+        session.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+    results.put(('read', timings))
+
+
+def write_client(url, body, duration, results):
+    """Sends POST requests to url as fast as possible and reports the status codes"""
+    session = requests.Session()
+    statuses = Counter()
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        statuses[session.post(url, json=body).status_code] += 1
+    results.put(('write', statuses))
+
+
+def bench_storm(args):
+    base = f'http://127.0.0.1:{args.port}'
+    read_url = f'{base}/api/product/{args.product}'
+    body = dict(customer_name='benchmark', customer_address='benchmark', products=[dict(name=args.product, quantity=1)])
+    print(f'GET {read_url} from {args.readers} clients, POST /api/order from {args.writers} clients, '
+          f'{args.workers} workers, WRITE_MAX_INFLIGHT={args.max_inflight}, {args.duration}s per run')
+    print(f'{"":>12} {"read p50":>9} {"read p99":>9} {"reads/s":>8}  writes')
+    server = start_server(args.workers, args.port, WRITE_MAX_INFLIGHT=str(args.max_inflight))
+    try:
+        run_clients(read_url, args.readers, 1)     # warm up the workers
+        for label, writers in (('reads only', 0), ('write storm', args.writers)):
+            results = multiprocessing.Queue()
+            procs = [multiprocessing.Process(target=read_client, args=(read_url, args.duration, results))
+                     for _ in range(args.readers)]
+            procs += [multiprocessing.Process(target=write_client, args=(f'{base}/api/order', body, args.duration, results))
+                      for _ in range(writers)]
+            for proc in procs:
+                proc.start()
+            timings, statuses = [], Counter()
+            for _ in procs:
+                kind, result = results.get()
+                if kind == 'read':
+                    timings.extend(result)
+                else:
+                    statuses.update(result)
+            for proc in procs:
+                proc.join()
+            timings.sort()
+            p99 = timings[int(len(timings) * 0.99) - 1]
+            writes = ', '.join(f'{count} x {status}' for status, count in sorted(statuses.items())) or '-'
+            print(f'{label:>12} {statistics.median(timings):>9.2f} {p99:>9.2f} {len(timings) / args.duration:>8.0f}  {writes}')
+    finally:
+        stop_server(server)
+
+    from app import app
+    from database import db
+    from models import Order
+    import writes
+
+    with app.app_context():
+        for order_id in db.session.scalars(db.select(Order.id).where(Order.name == 'benchmark')).all():
+            writes.delete_order(order_id)
+        db.session.commit()
+
+
+def bench_orders(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from app import app
+    from database import db
+    from groupcommit import group_commit
+    import writes
+
+    # the load comes from a single client, only the in flight limit stays
+    app.config.update(RATELIMIT_RATE=1e9, RATELIMIT_BURST=1e9, RATELIMIT_ROUTE_RATE=1e9, RATELIMIT_ROUTE_BURST=1e9,
+                      WRITE_MAX_INFLIGHT=args.threads, SQLITE_SYNCHRONOUS=args.synchronous)
+    order = dict(customer_name='benchmark', customer_address='benchmark', products=[dict(name=args.product, quantity=1)])
+
+    def place_orders(deadline):
+        client = app.test_client()
+        ids = []
+        while time.perf_counter() < deadline:
+            response = client.post('/api/order', json=order)
+            if response.status_code != 200:
+                raise RuntimeError(f'POST /api/order answered {response.status_code}: {response.get_data(as_text=True)}')
+            ids.append(response.json['order_id'])
+        return ids
+
+    print(f'POST /api/order from {args.threads} threads, {args.duration}s per run, synchronous={args.synchronous}')
+    print(f'{"":>12} {"orders/s":>10} {"per commit":>11}')
+    created = []
+    for label, enabled in (('per request', False), ('group', True)):
+        app.config['GROUP_COMMIT'] = enabled
+        before, batches, writes_before = len(created), group_commit.batches, group_commit.writes
+        deadline = time.perf_counter() + args.duration
+        with ThreadPoolExecutor(args.threads) as executor:
+            for ids in executor.map(place_orders, [deadline] * args.threads):
+                created.extend(ids)
+        throughput = (len(created) - before) / args.duration
+        per_commit = (group_commit.writes - writes_before) / max(1, group_commit.batches - batches) if enabled else 1
+        print(f'{label:>12} {throughput:>10.0f} {per_commit:>11.1f}')
+
+    with app.app_context():
+        for order_id in created:
+            writes.delete_order(order_id)
+        db.session.commit()
+
+
+def bench_replica(args):
+    base = f'http://127.0.0.1:{args.port}'
+    url = f'{base}/api/product/{args.product}'
+    bound = args.max_staleness
+    print(f'PUT/GET {url}, {args.workers} workers, REPLICA_MODE=copy, REPLICA_MAX_STALENESS={bound}s')
+    print(f'{"round":>6} {"writer read":>12} {"reader sees it after":>21}')
+    server = start_server(args.workers, args.port, REPLICA_MODE='copy', REPLICA_MAX_STALENESS=str(bound))
+    writer, reader = requests.Session(), requests.Session()     # only the writer gets the cookie
+    failures = []
+    original = writer.get(url).json()
+    try:
+        time.sleep(bound)   # let a copy be made, the reads go to the primary until then
+        for number in range(1, args.rounds + 1):
+            time.sleep(bound * (number % 4) / 4)     # the writes land at different points of the refresh cycle
+            price = round(original['price'] + number / 100, 2)
+            response = writer.put(url, json=dict(price=price, quantity=original['quantity']))
+            written = time.time()
+            if response.status_code != 200:
+                raise SystemExit(f'PUT {url} answered {response.status_code}: {response.text}')
+            own = writer.get(url).json()['price'] == price
+            while True:
+                started = time.time()
+                if reader.get(url).json()['price'] == price:
+                    delay = started - written
+                    break
+                if started - written > bound + args.tolerance:
+                    delay = None
+                    break
+                time.sleep(args.poll)
+            if not own:
+                failures.append(f'round {number}: the writer did not read its own write')
+            if delay is None:
+                failures.append(f'round {number}: the reader did not see the write within {bound}s')
+            seen = f'{delay:.2f}s' if delay is not None else 'never'
+            print(f'{number:>6} {"new" if own else "OLD":>12} {seen:>21}')
+    finally:
+        writer.put(url, json=dict(price=original['price'], quantity=original['quantity']))
+        stop_server(server)
+    if failures:
+        raise SystemExit('\n'.join(failures))
+    print(f'ok: the writer read its writes and the reader saw them within {bound}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=5055, help='port used for the benchmark server')
+    subparsers = parser.add_subparsers(dest='test', required=True)
+
+    read = subparsers.add_parser('read', help='read throughput scaling over the number of workers')
+    read.add_argument('--product', default='apple')
+    read.add_argument('--duration', type=float, default=10)
+    read.add_argument('--clients', type=int, default=2, help='client processes per server worker')
+    read.add_argument('--max-workers', type=int, default=max(1, multiprocessing.cpu_count() // 2),
+                      help='default: half the cores, the clients run on the other half')
+    read.add_argument('--url', help='base url of a server started elsewhere, only measures that server')
+    read.set_defaults(run=bench_read)
+
+    home = subparsers.add_parser('home', help='storefront page latency with and without the fragment cache')
+    home.add_argument('--requests', type=int, default=500)
+    home.add_argument('--encoding', default='gzip', help='Accept-Encoding sent by the client, empty for none')
+    home.set_defaults(run=bench_home)
+
+    storm = subparsers.add_parser('storm', help='read latency while the order endpoint is flooded')
+    storm.add_argument('--product', default='apple')
+    storm.add_argument('--duration', type=float, default=10)
+    storm.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    storm.add_argument('--readers', type=int, default=2, help='read client processes')
+    storm.add_argument('--writers', type=int, default=8, help='write client processes')
+    storm.add_argument('--max-inflight', type=int, default=8, help='WRITE_MAX_INFLIGHT of the server')
+    storm.set_defaults(run=bench_storm)
+
+    orders = subparsers.add_parser('orders', help='order throughput with and without group commit')
+    orders.add_argument('--product', default='apple')
+    orders.add_argument('--duration', type=float, default=5)
+    orders.add_argument('--threads', type=int, default=8)
+    orders.add_argument('--synchronous', default='FULL', help='sqlite synchronous setting: EXTRA, FULL, NORMAL or OFF')
+    orders.set_defaults(run=bench_orders)
+
+    replica = subparsers.add_parser('replica', help='staleness bound of the read replica in copy mode')
+    replica.add_argument('--product', default='apple')
+    replica.add_argument('--workers', type=int, default=2)
+    replica.add_argument('--rounds', type=int, default=8)
+    replica.add_argument('--max-staleness', type=float, default=1.0, help='REPLICA_MAX_STALENESS of the server')
+    replica.add_argument('--poll', type=float, default=0.05, help='seconds between the reads of the reader')
+    replica.add_argument('--tolerance', type=float, default=0.1,
+                         help='seconds allowed over the bound for the clocks and the request time')
+    replica.set_defaults(run=bench_replica)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""In-process cache for rendered fragments of the storefront.
+
+Entries are keyed on the catalog version (see models.catalog_version), so a
+product write in any worker makes the stale entries unreachable everywhere and
+they simply age out of the LRU.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+class FragmentCache:
+    """Small thread safe LRU cache"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        """Returns the cached value for key, calling render() to build it on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = render()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+catalog_cache = FragmentCache()
@@ -0,0 +1,75 @@
+"""Reading the change feed (see models.Change).
+
+Every change carries the current state of the order or product it points to
+(None once it's deleted), so clients can apply the deltas to what they already
+have instead of downloading the full lists again.
+"""
+import time
+
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
+
+from database import db
+from models import Change, Order, Product
+
+HEARTBEAT_INTERVAL = 15     # seconds, keeps proxies from closing an idle stream
+
+
+def current_seq(session=None):
+    session = session or db.session
+    return session.scalar(select(func.coalesce(func.max(Change.seq), 0)))
+
+
+def changes_since(since, limit=500, session=None):
+    """Returns the changes after the sequence number since, oldest first
+
+    Returns:
+        tuple: list of change dictionaries and the seq to resume from
+    """
+    session = session or db.session
+    change_list = session.scalars(select(Change).where(Change.seq > since).order_by(Change.seq).limit(limit)).all()
+    product_names = {change.key for change in change_list if change.entity == 'product'}
+    order_ids = {int(change.key) for change in change_list if change.entity == 'order'}
+    # one query per entity type for the current state of everything that changed
+    products = {}
+    if product_names:
+        products = {product.name: product.to_dict()
+                    for product in session.scalars(select(Product).where(Product.name.in_(product_names)))}
+    orders = {}
+    if order_ids:
+        query = select(Order).where(Order.id.in_(order_ids)).options(selectinload(Order.products))
+        orders = {str(order.id): order.to_dict() for order in session.scalars(query)}
+    result = []
+    for change in change_list:
+        data = change.to_dict()
+        data['data'] = (products if change.entity == 'product' else orders).get(change.key)
+        result.append(data)
+    last_seq = change_list[-1].seq if change_list else since
+    return result, last_seq
+
+
+def stream_changes(since=None):
+    """Generator of server-sent events for the changes after since (or the ones
+    made from now on when it's None), polling the feed every CHANGES_POLL_INTERVAL.
+
+    The stream ends after CHANGES_STREAM_MAX_AGE seconds, before the gunicorn
+    timeout kills the worker serving it. Its last event carries the seq reached,
+    so the EventSource reconnects with it in Last-Event-ID and nothing is missed.
+    """
+    interval = current_app.config['CHANGES_POLL_INTERVAL']
+    last_seq = current_seq() if since is None else since
+    last_sent = time.monotonic()
+    deadline = last_sent + current_app.config['CHANGES_STREAM_MAX_AGE']
+    yield f'retry: {int(interval * 2000)}\n\n'
+    while time.monotonic() < deadline:
+        change_list, last_seq = changes_since(last_seq)
+        db.session.rollback()   # end the read transaction so the next poll sees the new commits
+        for change in change_list:
+            yield f"id: {change['seq']}\nevent: change\ndata: {current_app.json.dumps(change)}\n\n"
+            last_sent = time.monotonic()
+        if time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+            yield ': heartbeat\n\n'
+            last_sent = time.monotonic()
+        time.sleep(interval)
+    yield f'id: {last_seq}\nevent: reconnect\ndata: {last_seq}\n\n'
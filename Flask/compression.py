@@ -0,0 +1,48 @@
+"""Content negotiation and compression of response bodies.
+
+gzip comes with python, brotli is used when the `brotli` package is installed
+and the client accepts it.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def choose_encoding(accept_encoding):
+    """Picks the best encoding supported by both the client and the server
+
+    Args:
+        accept_encoding (str): the Accept-Encoding header of the request
+
+    Returns:
+        str: 'br', 'gzip' or None for an uncompressed body
+    """
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        name, _, value = params.partition('=')
+        if name.strip() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    """Compresses data with the given encoding (see choose_encoding)"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return data
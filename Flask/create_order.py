@@ -20,4 +20,5 @@ with app.app_context():
         association = ProductsOrder(product=p, order=o, quantity=quantity)
         db.session.add(association)
 
+    o.update_total()
     db.session.commit()
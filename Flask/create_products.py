@@ -1,5 +1,5 @@
 from app import app, db
-from models import Product
+from models import Product, bump_catalog_version, record_movements
 
 products = [
     ("apple", 1.49, 100),
@@ -25,4 +25,6 @@ with app.app_context():
         db.session.add(obj)
         print(".", end="")
     print()
+    record_movements([(product[0], product[2], 'import', None) for product in products])
+    bump_catalog_version()
     db.session.commit()
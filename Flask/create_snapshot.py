@@ -0,0 +1,9 @@
+# Stores a snapshot of the stock of every product, meant to be run periodically
+# (e.g. from cron) so the stock at any time is computed from a short ledger tail
+from app import app
+from groupcommit import group_commit
+from inventory import take_snapshot
+
+with app.app_context():
+    movement_id = group_commit.run(take_snapshot)
+    print("Snapshot taken up to stock movement", movement_id)
@@ -1,5 +1,6 @@
 from app import app, db
+import migrations
 
 with app.app_context():
-    db.create_all()
+    migrations.upgrade(db.engine)
     print("All tables should have been created now.")
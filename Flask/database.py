@@ -1,3 +1,54 @@
+import sqlite3
+import warnings
+
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
+
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets the readers go on while a write (or a migration) holds the lock,
+    # and writers wait for the lock for a while instead of failing right away
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        # FULL syncs the WAL on every commit, NORMAL only at checkpoints: faster,
+        # but the last commits can be lost on a power failure (never corrupted).
+        # EXTRA also syncs the directory, OFF never syncs: a crash of the OS can
+        # corrupt the database
+        synchronous = current_app.config.get("SQLITE_SYNCHRONOUS", "FULL") if has_app_context() else "FULL"
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SYNCHRONOUS_LEVELS)}")
+        if synchronous == "OFF":
+            warnings.warn("SQLITE_SYNCHRONOUS=OFF: the database can be corrupted by a power failure or an OS crash",
+                          RuntimeWarning)
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.close()
+
+
+@event.listens_for(Engine, "begin")
+def begin_transaction(connection):
+    """Transactions started with the begin_immediate execution option send
+    BEGIN IMMEDIATE themselves: the write lock is taken right away (waiting on
+    busy_timeout) so their reads see the data they are going to write over.
+
+    By default sqlite3 only opens a transaction before INSERT/UPDATE/DELETE, so
+    a SAVEPOINT sent first would be a transaction of its own. The group commit
+    needs real SAVEPOINTs, sqlite3 is told to leave the BEGIN to us for these.
+    """
+    if connection.dialect.name != "sqlite" or connection.get_execution_options().get("isolation_level") == "AUTOCOMMIT":
+        return
+    dbapi_connection = connection.connection.dbapi_connection
+    if connection.get_execution_options().get("begin_immediate"):
+        dbapi_connection.isolation_level = None
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+    else:
+        dbapi_connection.isolation_level = ""
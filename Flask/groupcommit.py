@@ -0,0 +1,157 @@
+"""Group commit for the write endpoints.
+
+On sqlite every commit waits for the disk to sync, so the number of writes per
+second is capped by the sync rate of the disk, not by the work they do. With
+GROUP_COMMIT on, the writes of a worker process are handed to a single writer
+thread that waits GROUP_COMMIT_WINDOW seconds for the concurrent ones and runs
+up to GROUP_COMMIT_MAX_BATCH of them in one transaction, so they share one sync.
+Each write runs in its own SAVEPOINT: when it fails, or answers with an error
+status, only its changes are rolled back and the others are still committed.
+
+Only the writes running at the same time in a process can be grouped, that
+needs the threaded debug server or gthread gunicorn workers (see
+gunicorn.conf.py), and WRITE_MAX_INFLIGHT bounds the size of the groups.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from flask import current_app
+
+from database import db
+
+
+def succeeded(result):
+    """Tells whether the value returned by a write is a success, writes answer
+    like the views: an error is a (message, status) tuple with status >= 400
+    """
+    return not (isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], int) and result[1] >= 400)
+
+
+class GroupCommitter:
+
+    def __init__(self, app=None):
+        self._queue = None
+        self._writer = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GROUP_COMMIT', False)
+        app.config.setdefault('GROUP_COMMIT_WINDOW', 0.002)     # seconds waited for more writes after the first one
+        app.config.setdefault('GROUP_COMMIT_MAX_BATCH', 64)
+        # seconds a request waits for its group, above busy_timeout (5 s) plus the time of a batch
+        app.config.setdefault('GROUP_COMMIT_TIMEOUT', 10.0)
+
+    def run(self, write, *args):
+        """Runs write(*args) in a transaction and returns its result. The write
+        must only use db.session and must not commit, it is committed here: on
+        its own, or with the other writes of the group when GROUP_COMMIT is on.
+        The result must not hold ORM objects, they belong to the writer thread.
+
+        When the writer thread does not answer within GROUP_COMMIT_TIMEOUT the
+        request gets a 503: the write is dropped if it hasn't started yet,
+        otherwise it's given one more timeout to finish.
+        """
+        if not current_app.config['GROUP_COMMIT']:
+            db.session.connection(execution_options={'begin_immediate': True})
+            try:
+                result = write(*args)
+            except Exception:
+                db.session.rollback()
+                raise
+            if succeeded(result):
+                db.session.commit()
+            else:
+                db.session.rollback()
+            return result
+        future = Future()
+        self._writer_queue(current_app._get_current_object()).put((future, write, args))
+        timeout = current_app.config['GROUP_COMMIT_TIMEOUT']
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                return 'Server is busy, please retry later', 503, {'Retry-After': '1'}
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            current_app.logger.error('Write %s still running after %ss', write.__name__, 2 * timeout)
+            return 'Server is busy, the write could not be confirmed', 503, {'Retry-After': '1'}
+
+    def _writer_queue(self, app):
+        """Returns the queue of the writer thread of this process, starting it
+        after the fork so every gunicorn worker has its own, or again if it died
+        """
+        if self._writer is None or self._pid != os.getpid() or not self._writer.is_alive():
+            with self._lock:
+                if self._writer is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._pid = os.getpid()
+                elif self._writer.is_alive():
+                    return self._queue
+                self._writer = threading.Thread(target=self._write_batches, args=(app, self._queue), daemon=True)
+                self._writer.start()
+        return self._queue
+
+    def _write_batches(self, app, jobs):
+        while True:
+            batch = [jobs.get()]
+            deadline = time.monotonic() + app.config['GROUP_COMMIT_WINDOW']
+            while len(batch) < app.config['GROUP_COMMIT_MAX_BATCH']:
+                try:
+                    batch.append(jobs.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            with app.app_context():
+                self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        # drop the writes whose request gave up waiting, the others can't be cancelled anymore
+        batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            db.session.connection(execution_options={'begin_immediate': True})
+            for future, write, args in batch:
+                savepoint = db.session.begin_nested()
+                try:
+                    result = write(*args)
+                except Exception as error:
+                    savepoint.rollback()
+                    results.append((future, None, error))
+                    continue
+                if succeeded(result):
+                    savepoint.commit()
+                else:
+                    savepoint.rollback()
+                results.append((future, result, None))
+            db.session.commit()
+        except Exception as error:
+            # the group could not be committed, none of its writes happened
+            db.session.rollback()
+            current_app.logger.exception('Group commit of %d writes failed', len(batch))
+            for future, _, _ in batch:
+                future.set_exception(error)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def metrics(self):
+        return dict(batches=self.batches, writes=self.writes,
+                    writes_per_batch=round(self.writes / self.batches, 2) if self.batches else None)
+
+
+group_commit = GroupCommitter()
@@ -0,0 +1,41 @@
+"""gunicorn settings for serving the ThriftMart API with several worker processes.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Send SIGHUP to the master to gracefully restart the workers (in flight
+requests are finished first) and SIGTERM to shut it down. With preload_app the
+code is loaded once in the master, so SIGHUP does not pick up new code: to
+upgrade, send SIGUSR2 to start a new master with the new code next to the old
+one, then SIGQUIT to the old master once the new workers are up.
+All the values can be overridden with the usual environment variables.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('THRIFTMART_BIND', '0.0.0.0:5001')    # same port the terminal client uses
+
+# Pre-fork model: the requests are mostly short sqlite reads, so a couple of
+# workers per core keeps all the cores busy while one worker waits on the database
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('THRIFTMART_WORKER_CLASS', 'sync')
+threads = int(os.environ.get('THRIFTMART_THREADS', 1))     # with 'gthread', needed for GROUP_COMMIT to group anything
+
+# Load the app and the models once in the master, workers are forked with them already imported
+preload_app = True
+
+timeout = 30
+graceful_timeout = 30   # time given to the workers to finish their requests on reload/shutdown
+keepalive = 5
+
+# Recycle workers every now and then, the jitter keeps them from restarting all at once
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = os.environ.get('THRIFTMART_ACCESS_LOG', None)
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # every worker needs its own database connections, see wsgi.init_worker
+    from wsgi import init_worker
+    init_worker()
@@ -0,0 +1,75 @@
+"""Helpers to compute the stock of products from the stock movement ledger.
+
+The stock at any point in time is the quantity of the latest snapshot taken
+before that time plus the movements recorded after the snapshot, so only the
+tail of the ledger has to be read instead of the whole history.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, insert, literal, select
+
+from database import db
+from models import Product, StockMovement, StockSnapshot
+
+
+def take_snapshot():
+    """Stores the current quantity of every product as a snapshot, in a single
+    INSERT ... SELECT that also reads the ledger position, so a movement
+    committed meanwhile can't be both in the quantities and after movement_id.
+    The caller is responsible for the commit.
+
+    Returns:
+        int: id of the last movement included in the snapshot
+    """
+    last_movement = select(func.coalesce(func.max(StockMovement.id), 0)).scalar_subquery()
+    db.session.execute(
+        insert(StockSnapshot).from_select(
+            ['product_name', 'quantity', 'movement_id', 'taken_at'],
+            select(Product.name, Product.quantity, last_movement, literal(datetime.now())),
+        )
+    )
+    # read in the transaction opened by the INSERT, so it's the id it used
+    return db.session.scalar(select(StockSnapshot.movement_id).order_by(StockSnapshot.id.desc()).limit(1)) or 0
+
+
+def stock_at(product_name, when=None, session=None):
+    """Computes the stock of a product at a point in time
+
+    Args:
+        product_name (str): name of the product
+        when (datetime, optional): point in time, defaults to now
+        session (Session, optional): session to read with, defaults to db.session
+
+    Returns:
+        int: the quantity in stock at that time
+    """
+    session = session or db.session
+    if when is None:
+        product = session.get(Product, product_name)
+        if product is not None:
+            return product.quantity
+        when = datetime.now()
+    snapshot = session.execute(
+        select(StockSnapshot.quantity, StockSnapshot.movement_id)
+        .where(StockSnapshot.product_name == product_name, StockSnapshot.taken_at <= when)
+        .order_by(StockSnapshot.taken_at.desc(), StockSnapshot.id.desc())
+        .limit(1)
+    ).first()
+    base, after_id = (snapshot.quantity, snapshot.movement_id) if snapshot else (0, 0)
+    tail = session.scalar(
+        select(func.coalesce(func.sum(StockMovement.change), 0))
+        .where(StockMovement.product_name == product_name,
+               StockMovement.id > after_id,
+               StockMovement.created_at <= when)
+    )
+    return base + tail
+
+
+def movements(product_name, since=None, limit=100, session=None):
+    """Returns the latest movements of a product, newest first"""
+    session = session or db.session
+    query = select(StockMovement).where(StockMovement.product_name == product_name)
+    if since is not None:
+        query = query.where(StockMovement.created_at >= since)
+    query = query.order_by(StockMovement.id.desc()).limit(limit)
+    return session.scalars(query).all()
@@ -0,0 +1,13 @@
+import sys
+
+from app import app, db
+import migrations
+
+with app.app_context():
+    if len(sys.argv) > 1 and sys.argv[1] == 'current':
+        done = migrations.applied(db.engine)
+        for revision in migrations.MIGRATIONS:
+            print(f"[{'x' if revision in done else ' '}] {revision}")
+    else:
+        applied = migrations.upgrade(db.engine)
+        print(f"{len(applied)} migration(s) applied, the database is up to date.")
@@ -0,0 +1,10 @@
+from migrations.online import create_index
+
+description = 'indexes for the order listings and for loading the products of an order'
+
+
+def upgrade(engine):
+    create_index(engine, 'ix_order_completed_order_date', 'order', ['completed', 'order_date'])
+    create_index(engine, 'ix_order_completed_process_date', 'order', ['completed', 'process_date', 'order_date'])
+    # the primary key of products_order starts with product_name, lookups by order need their own index
+    create_index(engine, 'ix_products_order_order_id', 'products_order', ['order_id'])
@@ -0,0 +1,18 @@
+from sqlalchemy import text
+
+from migrations.online import backfill, has_column
+
+description = 'store the total price of orders instead of computing it on every read'
+
+
+def upgrade(engine):
+    if not has_column(engine, 'order', 'total'):
+        with engine.begin() as connection:
+            connection.execute(text('ALTER TABLE "order" ADD COLUMN total FLOAT'))
+    backfill(engine, 'order', '''
+        UPDATE "order" SET total = (
+            SELECT ROUND(COALESCE(SUM(products_order.quantity * product.price), 0), 2)
+            FROM products_order JOIN product ON product.name = products_order.product_name
+            WHERE products_order.order_id = "order".id)
+        WHERE total IS NULL AND id > :last AND id <= :upto
+    ''')
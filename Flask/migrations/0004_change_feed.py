@@ -0,0 +1,7 @@
+from database import db
+
+description = 'change feed of orders and products'
+
+
+def upgrade(engine):
+    db.metadata.create_all(engine, tables=[db.metadata.tables['change']])
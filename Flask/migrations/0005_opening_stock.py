@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, bindparam, text
+
+description = 'opening stock of the products that existed before the stock ledger'
+
+# the opening snapshots are dated before anything else, stock_at always finds one
+OPENING = datetime(1970, 1, 1)
+
+
+def upgrade(engine):
+    # Products of a database made before the ledger have no import movement, the
+    # ledger alone would give them a stock of 0 plus the later movements. Their
+    # opening snapshot holds the stock before the first movement in the ledger.
+    # BEGIN IMMEDIATE so no movement is recorded between the sum and the insert.
+    with engine.connect() as connection:
+        with connection.execution_options(begin_immediate=True).begin():
+            connection.execute(text('''
+                INSERT INTO stock_snapshot (product_name, quantity, movement_id, taken_at)
+                SELECT product.name, product.quantity - COALESCE(ledger.total, 0), 0, :opening
+                FROM product
+                LEFT JOIN (SELECT product_name, SUM(change) AS total FROM stock_movement GROUP BY product_name) AS ledger
+                    ON ledger.product_name = product.name
+                WHERE product.quantity != COALESCE(ledger.total, 0)
+                  AND NOT EXISTS (SELECT 1 FROM stock_snapshot WHERE stock_snapshot.product_name = product.name)
+            ''').bindparams(bindparam('opening', type_=DateTime)), dict(opening=OPENING))
@@ -0,0 +1,62 @@
+"""Schema migrations for store.db.
+
+Every migration is a module of this package listed in MIGRATIONS, in the order
+they have to run. A module has a `description` and an `upgrade(engine)`
+function, it gets the engine rather than a connection so long running steps
+(backfills) can commit in small batches and let the live traffic through.
+Applied revisions are recorded in the schema_migration table.
+
+    python migrate.py            # apply the pending migrations
+    python migrate.py current    # show the applied ones
+"""
+import importlib
+from datetime import datetime
+
+from sqlalchemy import text
+
+MIGRATIONS = [
+    '0001_baseline',
+    '0002_order_indexes',
+    '0003_order_total',
+    '0004_change_feed',
+    '0005_opening_stock',
+]
+
+
+def load(revision):
+    return importlib.import_module(f'{__name__}.{revision}')
+
+
+def ensure_version_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migration (revision VARCHAR PRIMARY KEY, applied_at DATETIME NOT NULL)'))
+
+
+def applied(engine):
+    """Returns the set of the revisions already applied to the database"""
+    ensure_version_table(engine)
+    with engine.connect() as connection:
+        return {row.revision for row in connection.execute(text('SELECT revision FROM schema_migration'))}
+
+
+def pending(engine):
+    done = applied(engine)
+    return [revision for revision in MIGRATIONS if revision not in done]
+
+
+def upgrade(engine, log=print):
+    """Applies the pending migrations in order
+
+    Returns:
+        list: the revisions that were applied
+    """
+    revisions = pending(engine)
+    for revision in revisions:
+        migration = load(revision)
+        log(f'Applying {revision}: {migration.description}')
+        migration.upgrade(engine)
+        with engine.begin() as connection:
+            connection.execute(text('INSERT INTO schema_migration (revision, applied_at) VALUES (:revision, :now)'),
+                               dict(revision=revision, now=datetime.now()))
+    return revisions
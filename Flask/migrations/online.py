@@ -0,0 +1,45 @@
+"""Building blocks for migrations that run while the app is serving requests."""
+import time
+
+from sqlalchemy import inspect, text
+
+
+def has_column(engine, table, column):
+    return column in {col['name'] for col in inspect(engine).get_columns(table)}
+
+
+def create_index(engine, name, table, columns):
+    """Creates an index without blocking the writers for longer than the build.
+
+    On postgres the index is built CONCURRENTLY. sqlite has no online index
+    build, the index is created in its own short transaction and, with the
+    database in WAL mode, the readers are not blocked while it runs and the
+    writers wait on busy_timeout instead of failing.
+    """
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON "{table}" ({column_list})'))
+    else:
+        with engine.begin() as connection:
+            connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({column_list})'))
+
+
+def backfill(engine, table, update_sql, batch_size=500, pause=0.01, log=print):
+    """Runs update_sql over the rows of table in batches of batch_size ids, each
+    batch in its own transaction so the write lock is only held for a moment,
+    with a short pause in between to let the live writes through.
+
+    Args:
+        update_sql (str): UPDATE statement restricted with `id > :last AND id <= :upto`
+    """
+    with engine.connect() as connection:
+        max_id = connection.execute(text(f'SELECT MAX(id) FROM "{table}"')).scalar() or 0
+    last = 0
+    while last < max_id:
+        upto = last + batch_size
+        with engine.begin() as connection:
+            connection.execute(text(update_sql), dict(last=last, upto=upto))
+        log(f'  {table}: backfilled up to id {min(upto, max_id)} of {max_id}')
+        last = upto
+        time.sleep(pause)
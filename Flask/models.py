@@ -1,5 +1,6 @@
 from database import db
 from datetime import datetime
+from sqlalchemy import func, insert, select, update
 
 
 class Product(db.Model):
@@ -12,6 +13,16 @@ class Product(db.Model):
         return dict(name=self.name, price=self.price, quantity=self.quantity)
 
 
+# names used in the API for the columns of Order
+ORDER_COLUMNS = dict(order_id='id',
+                     customer_name='name',
+                     customer_address='address',
+                     order_date='order_date',
+                     process_date='process_date',
+                     completed='completed')
+ORDER_FIELDS = ('order_id', 'customer_name', 'customer_address', 'order_date', 'process_date', 'completed', 'products', 'price')
+
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String, nullable=False)
@@ -19,25 +30,39 @@ class Order(db.Model):
     completed = db.Column(db.Boolean, default=False, nullable=False)
     order_date = db.Column(db.DateTime, nullable=False, default=datetime.now())
     process_date = db.Column(db.DateTime, nullable=True)    # figure this out
+    total = db.Column(db.Float, nullable=True)      # current price while pending, price when processed, see update_total
     products = db.relationship('ProductsOrder', back_populates='order')
 
-    def to_dict(self):
-        products_list = []
-        for prodord in self.products:
-            products_list.append(dict(name=prodord.product.name, quantity=prodord.quantity))
+    def to_dict(self, fields=None):
+        """Returns the order as a dictionary, restricted to fields if given (see ORDER_FIELDS)"""
+        fields = ORDER_FIELDS if fields is None else fields
+        data = {}
+        for field in fields:
+            if field == 'products':
+                data['products'] = [dict(name=prodord.product_name, quantity=prodord.quantity) for prodord in self.products]
+            elif field == 'price':
+                data['price'] = self.total if self.total is not None else self.compute_total()
+            else:
+                data[field] = getattr(self, ORDER_COLUMNS[field])
+        return data
+        
+    def compute_total(self):
         total_price = 0
         for prodord in self.products:
             total_price += prodord.product.price * prodord.quantity
-        return dict(order_id=self.id,
-                    customer_name=self.name, 
-                    customer_address=self.address, 
-                    order_date=self.order_date,
-                    process_date=self.process_date,
-                    completed=self.completed, 
-                    products=products_list, 
-                    price=round(total_price, 2))
-        
+        return round(total_price, 2)
+
+    def update_total(self):
+        """Stores the total price of the products currently in the order. The
+        total of a pending order follows the prices of its products (see
+        update_pending_totals), it's fixed once the order is processed
+        """
+        self.total = self.compute_total()
+
     def process(self):
+        """Takes the products of the order out of the stock, as part of the
+        current transaction (the caller commits)
+        """
         for item in self.products:
             product = item.product
             if product.quantity < item.quantity:
@@ -45,9 +70,31 @@ class Order(db.Model):
             product.quantity -= item.quantity
             if product.quantity < 0:
                 product.quantity = 0
+        record_movements([(item.product_name, -item.quantity, 'order', self.id) for item in self.products])
+        record_changes([('order', self.id, 'process')] + [('product', item.product_name, 'update') for item in self.products])
+        bump_catalog_version()
+        self.update_total()     # quantities may have been reduced to what was in stock, last update of the total
         self.process_date = datetime.now()
         self.completed = True
-        db.session.commit()
+
+
+def update_pending_totals(product_name):
+    """Recomputes the total of the pending orders containing a product whose
+    price changed, as part of the current transaction
+
+    Returns:
+        list: ids of the orders updated
+    """
+    order_ids = db.session.scalars(
+        select(Order.id).join(ProductsOrder, ProductsOrder.order_id == Order.id)
+        .where(ProductsOrder.product_name == product_name, Order.completed.is_(False))).all()
+    if order_ids:
+        total = (select(func.round(func.coalesce(func.sum(ProductsOrder.quantity * Product.price), 0), 2))
+                 .join(Product, Product.name == ProductsOrder.product_name)
+                 .where(ProductsOrder.order_id == Order.id).scalar_subquery())
+        db.session.execute(update(Order).where(Order.id.in_(order_ids)).values(total=total),
+                           execution_options={'synchronize_session': 'fetch'})
+    return order_ids
 
 
 class ProductsOrder(db.Model):
@@ -56,4 +103,97 @@ class ProductsOrder(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     product = db.relationship('Product', back_populates='orders')  # add back_populate for Product too?
     order = db.relationship('Order', back_populates='products')
-    
\ No newline at end of file
+    
+
+class StockMovement(db.Model):
+    """Append only ledger of every change made to the stock of a product.
+    Rows are never updated, the product name is not a foreign key so the history
+    survives the removal of a product or an order.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product_name = db.Column(db.String, nullable=False)
+    change = db.Column(db.Integer, nullable=False)     # signed, negative when stock leaves the store
+    reason = db.Column(db.String, nullable=False)      # 'order', 'adjustment', 'import' or 'recount'
+    order_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    __table_args__ = (db.Index('ix_stock_movement_product_id', 'product_name', 'id'),)
+
+    def to_dict(self):
+        return dict(id=self.id, product_name=self.product_name, change=self.change,
+                    reason=self.reason, order_id=self.order_id, created_at=self.created_at)
+
+
+class StockSnapshot(db.Model):
+    """Stock of a product at a point in the ledger, movement_id is the last
+    movement already included in quantity.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product_name = db.Column(db.String, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    movement_id = db.Column(db.Integer, nullable=False, default=0)
+    taken_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    __table_args__ = (db.Index('ix_stock_snapshot_product_taken', 'product_name', 'taken_at'),)
+
+
+def record_movements(movements):
+    """Appends stock movements to the ledger as part of the current transaction,
+    all of them are written with a single batched insert.
+
+    Args:
+        movements (list): (product_name, change, reason, order_id) tuples
+    """
+    now = datetime.now()
+    rows = [dict(product_name=name, change=change, reason=reason, order_id=order_id, created_at=now)
+            for name, change, reason, order_id in movements if change != 0]
+    if rows:
+        db.session.execute(insert(StockMovement), rows)
+
+
+class CatalogVersion(db.Model):
+    """Single row counter incremented every time the catalog (products, prices
+    or stock) changes, used as the key of the storefront cache
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+def catalog_version(session=None):
+    """Returns the current catalog version"""
+    session = session or db.session
+    return session.scalar(select(CatalogVersion.version).where(CatalogVersion.id == 1)) or 0
+
+
+def bump_catalog_version():
+    """Increments the catalog version as part of the current transaction, with
+    a single atomic UPDATE so concurrent writers do not lose increments
+    """
+    result = db.session.execute(update(CatalogVersion).where(CatalogVersion.id == 1).values(version=CatalogVersion.version + 1))
+    if result.rowcount == 0:
+        db.session.add(CatalogVersion(id=1, version=1))
+
+
+class Change(db.Model):
+    """Change feed: one row for every order or product committed by the API,
+    seq is a monotonic sequence clients can resume from
+    """
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String, nullable=False)      # 'order' or 'product'
+    key = db.Column(db.String, nullable=False)         # order id or product name
+    op = db.Column(db.String, nullable=False)          # 'create', 'update', 'process' or 'delete'
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def to_dict(self):
+        return dict(seq=self.seq, entity=self.entity, key=self.key, op=self.op, created_at=self.created_at)
+
+
+def record_changes(changes):
+    """Appends entries to the change feed as part of the current transaction,
+    with a single batched insert
+
+    Args:
+        changes (list): (entity, key, op) tuples
+    """
+    now = datetime.now()
+    rows = [dict(entity=entity, key=str(key), op=op, created_at=now) for entity, key, op in changes]
+    if rows:
+        db.session.execute(insert(Change), rows)
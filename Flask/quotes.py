@@ -0,0 +1,73 @@
+"""Order quotes: a cart priced and checked against the stock before it's submitted.
+
+POST /api/order/quote checks all the products of the cart with one query and
+answers with the prices and a signed token holding them, together with the
+position of the change feed at the time of the quote. An order submitted with
+that token within QUOTE_MAX_AGE seconds, for the same cart, is created from
+the quote without reading the products again, unless the change feed has an
+entry for one of them since the quote (new stock, price, order processed...).
+Any other token, expired or not, just makes the order go through the usual checks.
+"""
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import select
+
+from database import db
+from models import Change, Product
+from changes import current_seq
+
+
+def serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='order-quote')
+
+
+def quote_cart(products):
+    """Prices the cart and checks the stock of its products
+
+    Args:
+        products (list): dictionaries with the name and quantity of the products
+
+    Returns:
+        tuple: the quote and 200, or an error message and its status
+    """
+    names = [item['name'] for item in products]
+    for item in products:
+        if (not isinstance(item['quantity'], int)) or item['quantity'] < 0:
+            return f"Invalid quantity for {item['name']}, only non-negative int values accepted", 400
+    # read before the products: a change made in between is after seq and only costs a revalidation
+    seq = current_seq()
+    stock = {product.name: product for product in db.session.scalars(select(Product).where(Product.name.in_(names)))}
+    lines = []
+    for item in products:
+        product = stock.get(item['name'])
+        if product is None:
+            return f"Product {item['name']} is not in the store", 404
+        if item['quantity'] > product.quantity:
+            return f"Insufficient inventory for product: {item['name']}", 400
+        lines.append(dict(name=product.name, quantity=item['quantity'], price=product.price,
+                          subtotal=round(product.price * item['quantity'], 2)))
+    price = round(sum(line['price'] * line['quantity'] for line in lines), 2)
+    token = serializer().dumps(dict(seq=seq, price=price, products=[[line['name'], line['quantity']] for line in lines]))
+    return dict(products=lines, price=price, quote_token=token, expires_in=current_app.config['QUOTE_MAX_AGE']), 200
+
+
+def load_quote(token):
+    """Returns the content of a quote token, None if it's missing, expired or not genuine"""
+    if not token:
+        return None
+    try:
+        return serializer().loads(token, max_age=current_app.config['QUOTE_MAX_AGE'])
+    except BadSignature:    # also raised when it's expired
+        return None
+
+
+def is_current(quote, products):
+    """Tells whether quote was made for this cart and none of its products
+    changed since, must run in the transaction that creates the order
+    """
+    if [[item['name'], item['quantity']] for item in products] != quote['products']:
+        return False
+    names = [name for name, _ in quote['products']]
+    changed = db.session.scalar(select(Change.seq).where(
+        Change.seq > quote['seq'], Change.entity == 'product', Change.key.in_(names)).limit(1))
+    return changed is None
@@ -0,0 +1,242 @@
+"""Rate limiting and load shedding for the write endpoints.
+
+Every write request has to take a token from two token buckets, one for the
+client on that route and one shared by all the clients of the route, and
+is answered with 429 when either is empty. On top of that at most
+WRITE_MAX_INFLIGHT writes run at the same time on the whole server, the ones
+over the limit are shed right away with 503 instead of queueing on the sqlite
+write lock (shared by all the workers) and starving the reads. Both answers
+carry a Retry-After header.
+
+The buckets live in process memory by default, set RATELIMIT_STORAGE_URL to a
+redis url to share them between the gunicorn workers. The in flight writes are
+counted with lock files in WRITE_SLOTS_DIR, shared by the workers of the host,
+or in redis when RATELIMIT_STORAGE_URL is set.
+"""
+import math
+import os
+import threading
+import uuid
+import time
+from collections import Counter, deque
+from functools import wraps
+
+from flask import current_app, request
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import fcntl
+except ImportError:     # not on windows, the slots are then counted per process
+    fcntl = None
+
+
+class MemoryBackend:
+    """Token buckets kept in a dictionary of the current process"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        """Takes a token from the bucket key, refilled at rate tokens per second
+        up to capacity
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+
+class FileSlots:
+    """Counts the writes in flight on the host with one lock file per slot: a
+    write holds an exclusive flock on a free slot file. The lock goes away with
+    the process holding it, so a worker killed in the middle of a write does
+    not leak its slot.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.taken = 0      # used instead of the files when fcntl is not available
+        self._lock = threading.Lock()
+        if fcntl is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def acquire_slot(self, limit):
+        """Takes one of limit slots
+
+        Returns:
+            a token to pass to release_slot, None if all the slots are taken
+        """
+        if fcntl is None:
+            with self._lock:
+                if self.taken >= limit:
+                    return None
+                self.taken += 1
+                return True
+        start = os.getpid() + threading.get_ident()     # spread the workers over the slots
+        for i in range(limit):
+            fd = os.open(os.path.join(self.directory, f'slot-{(start + i) % limit}'), os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def release_slot(self, token):
+        if fcntl is None:
+            with self._lock:
+                self.taken -= 1
+            return
+        fcntl.flock(token, fcntl.LOCK_UN)
+        os.close(token)
+
+
+class RedisBackend:
+    """Token buckets shared by all the workers through redis, the refill and
+    the take happen atomically in a lua script
+    """
+    SCRIPT = '''
+        local rate, capacity, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+        return tostring(wait)
+    '''
+    # the slots are members of a sorted set scored by when they were taken, the
+    # ones older than SLOT_TTL are dropped in case their worker died
+    SLOT_SCRIPT = '''
+        local limit, now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - ttl)
+        if redis.call('ZCARD', KEYS[1]) >= limit then return 0 end
+        redis.call('ZADD', KEYS[1], now, ARGV[4])
+        redis.call('EXPIRE', KEYS[1], ttl)
+        return 1
+    '''
+    SLOT_TTL = 60
+    SLOTS_KEY = 'thriftmart:ratelimit:inflight'
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('RATELIMIT_STORAGE_URL needs the redis package to be installed')
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+        self._acquire = self._client.register_script(self.SLOT_SCRIPT)
+
+    def take(self, key, rate, capacity):
+        return float(self._take(keys=[f'thriftmart:ratelimit:{key}'], args=[rate, capacity, time.time()]))
+
+    def acquire_slot(self, limit):
+        token = uuid.uuid4().hex
+        if self._acquire(keys=[self.SLOTS_KEY], args=[limit, time.time(), self.SLOT_TTL, token]):
+            return token
+        return None
+
+    def release_slot(self, token):
+        self._client.zrem(self.SLOTS_KEY, token)
+
+
+class WriteLimiter:
+    """Rate limiter and concurrency limiter for the write endpoints, also
+    collects the metrics served by /api/metrics
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.slots = None
+        self.inflight = 0       # writes in flight in this process, for the metrics
+        self._lock = threading.Lock()
+        self.shed = Counter()       # (route, reason) -> number of requests refused
+        self.read_latencies = deque(maxlen=2000)    # seconds, the latest GET requests
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_RATE', 5.0)        # tokens per second per client and route
+        app.config.setdefault('RATELIMIT_BURST', 10)
+        app.config.setdefault('RATELIMIT_ROUTE_RATE', 50.0)  # tokens per second per route, all clients together
+        app.config.setdefault('RATELIMIT_ROUTE_BURST', 100)
+        app.config.setdefault('RATELIMIT_STORAGE_URL', None)
+        app.config.setdefault('WRITE_MAX_INFLIGHT', 8)        # for the whole server, all the workers together
+        app.config.setdefault('WRITE_SLOTS_DIR', os.path.join(app.instance_path, '.write-slots'))
+        url = app.config['RATELIMIT_STORAGE_URL']
+        self.backend = RedisBackend(url) if url else MemoryBackend()
+        self.slots = self.backend if url else FileSlots(app.config['WRITE_SLOTS_DIR'])
+        app.before_request(self._start_timer)
+        app.after_request(self._record_latency)
+
+    def _start_timer(self):
+        request.started = time.perf_counter()
+
+    def _record_latency(self, response):
+        if request.method == 'GET' and hasattr(request, 'started'):
+            self.read_latencies.append(time.perf_counter() - request.started)
+        return response
+
+    def _refuse(self, route, reason, status, retry_after):
+        with self._lock:
+            self.shed[(route, reason)] += 1
+        message = 'Too many requests, please retry later' if status == 429 else 'Server is busy, please retry later'
+        return message, status, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+    def limit_writes(self, view):
+        """Decorator for the write views"""
+        @wraps(view)
+        def limited(*args, **kwargs):
+            config = current_app.config
+            route = request.endpoint
+            client = request.remote_addr or 'unknown'
+            wait = self.backend.take(f'{route}:{client}', config['RATELIMIT_RATE'], config['RATELIMIT_BURST'])
+            if not wait:
+                wait = self.backend.take(route, config['RATELIMIT_ROUTE_RATE'], config['RATELIMIT_ROUTE_BURST'])
+            if wait:
+                return self._refuse(route, 'rate_limited', 429, wait)
+            slot = self.slots.acquire_slot(config['WRITE_MAX_INFLIGHT'])
+            if slot is None:
+                return self._refuse(route, 'overloaded', 503, 1)
+            with self._lock:
+                self.inflight += 1
+            try:
+                return view(*args, **kwargs)
+            finally:
+                self.slots.release_slot(slot)
+                with self._lock:
+                    self.inflight -= 1
+        return limited
+
+    def metrics(self):
+        """Returns the counters of refused requests and the read latency percentiles"""
+        latencies = sorted(self.read_latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+        with self._lock:
+            shed = [dict(route=route, reason=reason, count=count) for (route, reason), count in self.shed.items()]
+            inflight = self.inflight
+        return dict(shed=shed,
+                    shed_total=sum(item['count'] for item in shed),
+                    writes_in_flight=inflight,
+                    read_latency_ms=dict(p50=percentile(0.5), p99=percentile(0.99), samples=len(latencies)))
+
+
+limiter = WriteLimiter()
@@ -0,0 +1,175 @@
+"""Reconciles the stock in the database with a warehouse count.
+
+    python reconcile_stock.py count.csv --report discrepancies.csv [--dry-run]
+
+count.csv has a `name,quantity` header and is sorted by name (byte order, e.g.
+`LC_ALL=C sort`). The file and the products table are walked side by side in
+name order, so memory use does not depend on the number of products. Only the
+products whose quantity differs are updated, in batches of one transaction
+each, and every update is recorded in the stock ledger and the change feed.
+
+The report has one row per discrepancy:
+  * changed: the quantity was set to the counted one (would_change with --dry-run)
+  * conflict: the stock moved (e.g. an order was processed) while reconciling,
+    the product was left alone and should be counted again
+  * unknown: the product in the file does not exist in the database
+  * not_counted: the product is missing from the file, it was left alone
+"""
+import argparse
+import csv
+import sys
+import time
+
+from sqlalchemy import bindparam, select, update
+
+from app import app, db
+from models import Product, bump_catalog_version, record_changes, record_movements
+
+
+def read_count(path):
+    """Yields (name, quantity) from the count file, checking the order"""
+    with open(path, newline='') as file:
+        previous = None
+        for line, row in enumerate(csv.DictReader(file), start=2):
+            name = row['name'].strip()
+            if previous is not None and name <= previous:
+                raise ValueError(f'{path}:{line}: {name!r} is not after {previous!r}, the file must be sorted by name without duplicates')
+            quantity = int(row['quantity'])
+            if quantity < 0:
+                raise ValueError(f'{path}:{line}: negative quantity for {name!r}')
+            previous = name
+            yield name, quantity
+
+
+def read_products(chunk_size):
+    """Yields (name, quantity) of all the products in name order, reading the
+    table in chunks after the last name seen so no cursor stays open while the
+    batches are committed
+    """
+    last = None
+    while True:
+        query = select(Product.name, Product.quantity).order_by(Product.name).limit(chunk_size)
+        if last is not None:
+            query = query.where(Product.name > last)
+        rows = db.session.execute(query).all()
+        db.session.rollback()   # end the read transaction, the next chunk sees the committed batches
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1].name
+
+
+def merge(counted, stored):
+    """Sorted merge of the two (name, quantity) streams
+
+    Yields:
+        tuple: name, counted quantity, stored quantity (None when missing on that side)
+    """
+    missing = (None, None)
+    count_row, stored_row = next(counted, missing), next(stored, missing)
+    while count_row[0] is not None or stored_row[0] is not None:
+        if stored_row[0] is None or (count_row[0] is not None and count_row[0] < stored_row[0]):
+            yield count_row[0], count_row[1], None
+            count_row = next(counted, missing)
+        elif count_row[0] is None or stored_row[0] < count_row[0]:
+            yield stored_row[0], None, stored_row[1]
+            stored_row = next(stored, missing)
+        else:
+            yield count_row[0], count_row[1], stored_row[1]
+            count_row, stored_row = next(counted, missing), next(stored, missing)
+
+
+def apply_batch(batch):
+    """Sets the counted quantities in one transaction. A row is only updated if
+    its quantity is still the one the diff was made against
+
+    Returns:
+        list: names that could not be updated because their stock moved
+    """
+    table = Product.__table__
+    statement = update(table).where(table.c.name == bindparam('product'), table.c.quantity == bindparam('old'))
+    applied, conflicts = [], []
+    for name, counted, stored in batch:
+        result = db.session.execute(statement.values(quantity=counted), dict(product=name, old=stored))
+        (applied if result.rowcount else conflicts).append((name, counted, stored))
+    record_movements([(name, counted - stored, 'recount', None) for name, counted, stored in applied])
+    record_changes([('product', name, 'update') for name, _, _ in applied])
+    if applied:
+        bump_catalog_version()
+    db.session.commit()
+    return {name for name, _, _ in conflicts}
+
+
+def reconcile(count_path, report_file, batch_size=1000, chunk_size=5000, dry_run=False):
+    """Runs the reconciliation, writes the discrepancies to report_file in name
+    order: the rows met while a batch is pending are held until it's applied,
+    which happens when batch_size rows are held, so there are never more
+
+    Returns:
+        dict: number of rows per status
+    """
+    report = csv.writer(report_file)
+    report.writerow(['name', 'counted', 'system', 'difference', 'status'])
+    changed = 'would_change' if dry_run else 'changed'
+    totals = {'checked': 0, changed: 0, 'conflict': 0, 'unknown': 0, 'not_counted': 0}
+    batch = []
+    held = []   # report rows in name order since the batch started, status None for the batch entries
+
+    def write(row):
+        totals[row[-1]] += 1
+        if batch:
+            held.append(row)
+        else:
+            report.writerow(row)
+
+    def flush():
+        conflicts = set() if dry_run else apply_batch(batch)
+        for row in held:
+            if row[-1] is None:
+                row[-1] = 'conflict' if row[0] in conflicts else changed
+                totals[row[-1]] += 1
+            report.writerow(row)
+        batch.clear()
+        held.clear()
+
+    for name, counted, stored in merge(read_count(count_path), read_products(chunk_size)):
+        totals['checked'] += 1
+        if stored is None:
+            write([name, counted, '', '', 'unknown'])
+        elif counted is None:
+            write([name, '', stored, '', 'not_counted'])
+        elif counted != stored:
+            held.append([name, counted, stored, counted - stored, None])
+            batch.append((name, counted, stored))
+        if len(held) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('count', help='CSV file with the counted quantities, sorted by name')
+    parser.add_argument('--report', help='where to write the discrepancy report (default: stdout)')
+    parser.add_argument('--batch-size', type=int, default=1000, help='updates per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='only report, do not update the database')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report_file = open(args.report, 'w', newline='') if args.report else sys.stdout
+    try:
+        with app.app_context():
+            totals = reconcile(args.count, report_file, batch_size=args.batch_size, dry_run=args.dry_run)
+    except ValueError as error:
+        sys.exit(f'Reconciliation stopped: {error}')
+    finally:
+        if args.report:
+            report_file.close()
+    elapsed = time.perf_counter() - start
+    summary = ', '.join(f'{count} {status}' for status, count in totals.items())
+    print(f'{summary} in {elapsed:.2f}s' + (' (dry run, nothing was updated)' if args.dry_run else ''), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
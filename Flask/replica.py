@@ -0,0 +1,185 @@
+"""Routing of the read-only requests to a replica of store.db.
+
+REPLICA_MODE selects where the GET endpoints read from:
+  * 'off': everything goes through db.session, like before
+  * 'wal': a separate read-only connection to store.db. In WAL mode the readers
+    never wait for the writers and always see the latest commit
+  * 'copy': a copy of store.db (REPLICA_PATH) refreshed in the background with
+    the sqlite backup API. A read is sent to the primary instead whenever the
+    copy is older than REPLICA_MAX_STALENESS seconds, so that is the bound on
+    how stale a read can be
+
+A client that just wrote something reads its own writes: write responses set a
+cookie with the time of the write, and a GET carrying a cookie newer than the
+replica is answered from the primary. Clients have to keep the cookies (the
+terminal interface goes through one requests.Session for that).
+
+Every refresh is a full copy of the database. Only one process of the host
+refreshes the copy, the one holding the lock on the <replica>.lock file, the
+others take over if it exits.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, request
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from database import db
+
+try:
+    import fcntl
+except ImportError:     # not on windows, every process refreshes the copy then
+    fcntl = None
+
+LAST_WRITE_COOKIE = 'thriftmart_last_write'
+
+
+class ReadReplica:
+
+    def __init__(self, app=None):
+        self._engine = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._refresh_lock = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REPLICA_MODE', 'off')
+        app.config.setdefault('REPLICA_PATH', None)     # defaults to <primary>-replica.db
+        app.config.setdefault('REPLICA_MAX_STALENESS', 2.0)
+        app.after_request(self._remember_write)
+        app.teardown_appcontext(self._close_session)
+
+    @property
+    def mode(self):
+        return current_app.config['REPLICA_MODE']
+
+    def primary_path(self):
+        return db.engine.url.database
+
+    def replica_path(self):
+        return current_app.config['REPLICA_PATH'] or self.primary_path().replace('.db', '') + '-replica.db'
+
+    def engine(self):
+        """Returns the read-only engine of this process (created after the fork
+        so gunicorn workers never share it)
+        """
+        if self._engine is None or self._pid != os.getpid():
+            with self._lock:
+                if self._engine is None or self._pid != os.getpid():
+                    if self.mode == 'wal':
+                        url = f'sqlite:///file:{self.primary_path()}?mode=ro&uri=true'
+                    else:
+                        # the copy is never modified in place, it is replaced as a whole by refresh()
+                        url = f'sqlite:///file:{self.replica_path()}?immutable=1&uri=true'
+                    self._engine = create_engine(url, poolclass=NullPool)
+                    self._pid = os.getpid()
+                    self._refresher = None
+                    self._refresh_lock = None   # the lock of the parent is not ours
+        return self._engine
+
+    def refreshed_at(self):
+        """Returns the time the data in the copy was taken, 0 if there's no copy"""
+        try:
+            return os.path.getmtime(self.replica_path())
+        except OSError:
+            return 0
+
+    def refresh(self):
+        """Copies the primary into a temporary file, then swaps it in place of
+        the replica, so readers never see a half written copy. The modification
+        time of the replica is set to when the copy started.
+        """
+        started = time.time()
+        path = self.replica_path()
+        temporary = f'{path}.{os.getpid()}.tmp'
+        source = sqlite3.connect(self.primary_path())
+        target = sqlite3.connect(temporary)
+        try:
+            source.backup(target)
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            source.close()
+            target.close()
+        os.utime(temporary, (started, started))
+        os.replace(temporary, path)
+
+    def _holds_refresh_lock(self):
+        """Tells whether this process is the one refreshing the copy, taking
+        the lock if it's free
+        """
+        if fcntl is None or self._refresh_lock is not None:
+            return True
+        fd = os.open(self.replica_path() + '.lock', os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._refresh_lock = fd     # kept until the process exits
+        return True
+
+    def _start_refresher(self, app):
+        """Starts the thread that keeps the copy fresh, it only refreshes while
+        this process holds the refresh lock
+        """
+        interval = app.config['REPLICA_MAX_STALENESS'] / 2
+
+        def run():
+            while True:
+                with app.app_context():
+                    if self._holds_refresh_lock() and time.time() - self.refreshed_at() >= interval:
+                        try:
+                            self.refresh()
+                        except (OSError, sqlite3.Error) as error:
+                            app.logger.warning('Could not refresh the read replica: %s', error)
+                time.sleep(interval)
+
+        self._refresher = threading.Thread(target=run, daemon=True)
+        self._refresher.start()
+
+    def use_primary(self):
+        """Decides whether the current request has to read from the primary"""
+        if self.mode == 'off':
+            return True
+        if self.mode == 'copy':
+            self.engine()
+            if self._refresher is None:
+                with self._lock:
+                    if self._refresher is None:
+                        self._start_refresher(current_app._get_current_object())
+            refreshed_at = self.refreshed_at()
+            if time.time() - refreshed_at > current_app.config['REPLICA_MAX_STALENESS']:
+                return True
+            last_write = request.cookies.get(LAST_WRITE_COOKIE, 0, type=float)
+            return last_write >= refreshed_at
+        return False
+
+    def session(self):
+        """Returns the session the current read request should use"""
+        if 'read_session' not in g:
+            g.read_session = db.session if self.use_primary() else Session(bind=self.engine())
+        return g.read_session
+
+    def query(self, model):
+        return self.session().query(model)
+
+    def _remember_write(self, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code == 200 and self.mode == 'copy':
+            response.set_cookie(LAST_WRITE_COOKIE, str(time.time()),
+                                max_age=int(current_app.config['REPLICA_MAX_STALENESS']) + 1, httponly=True)
+        return response
+
+    def _close_session(self, exception):
+        session = g.pop('read_session', None)
+        if session is not None and session is not db.session:
+            session.close()
+
+
+replica = ReadReplica()
@@ -0,0 +1,266 @@
+"""In-memory index of the product names for prefix and typo tolerant lookups.
+
+The index is built from the database on the first search of a worker and then
+kept up to date incrementally: the product endpoints add/remove names in the
+worker that handled the write, and every SEARCH_SYNC_INTERVAL the other
+workers apply the product creations/deletions they missed from the change feed.
+
+A lookup costs about the same on a large catalog as on a small one: every trie
+node knows the best ranked name under it, so the prefix walk only goes down the
+branches holding the results, and the typo lookup skips the trigrams shared by
+too many names (the padding of a first letter, '000'...).
+"""
+import heapq
+import itertools
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import select
+
+from database import db
+from models import Change, Product
+from changes import current_seq
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# a trigram in more names than this does not narrow down the typo candidates
+MAX_POSTING = 1000
+# names checked with the edit distance, the ones sharing the most trigrams with the text
+MAX_CANDIDATES = 100
+
+
+def typo_distances(text, keys, bound):
+    """Levenshtein distances between text and each key: to the whole key, or
+    to a prefix of it one char shorter/longer than text (typo while typing),
+    whichever is the smallest, bound + 1 when it's larger than bound.
+
+    Row m of the table holds the distances between key[:m] and the prefixes
+    of text. The keys are handled in order, so the rows of the beginning a key
+    shares with the previous one are kept, and a key is given up as soon as a
+    whole row is over bound.
+
+    Returns:
+        dict: key -> distance
+    """
+    over = bound + 1
+    rows = [list(range(len(text) + 1))]
+    previous = ''
+    distances = {}
+    for key in sorted(keys):
+        common = 0
+        while common < len(rows) - 1 and common < len(key) and key[common] == previous[common]:
+            common += 1
+        del rows[common + 1:]
+        for char in key[common:]:
+            last = rows[-1]
+            if min(last) > bound:
+                break
+            row = [last[0] + 1]
+            for j, char_text in enumerate(text, start=1):
+                row.append(min(last[j] + 1, row[j - 1] + 1, last[j - 1] + (char != char_text)))
+            rows.append(row)
+        ends = {len(text) - 1, len(text), len(text) + 1}
+        if len(key) <= len(text) + bound:
+            ends.add(len(key))    # a longer key only matches by its prefixes
+        distances[key] = min([rows[end][-1] for end in ends if end < len(rows)] + [over])
+        previous = key
+    return distances
+
+
+class Node:
+    """Node of the trie, best is the best ranked entry of its subtree"""
+    __slots__ = ('children', 'entries', 'best')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = None     # entries of the names ending at this node
+        self.best = None
+
+    def update_best(self):
+        bests = [child.best for child in self.children.values()]
+        self.best = min(itertools.chain(self.entries or (), bests), default=None)
+
+
+class ProductIndex:
+    """Prefix trie over the product names (and over every word of them, so
+    'bre' finds 'chicken breast') plus a trigram index for the typos.
+
+    The trie holds (not full name, length, name) entries, the order of the
+    prefix results: full name matches first, then the shortest names.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.names = set()
+            self.trie = Node()
+            self.grams = {}
+            self.seq = None         # last change feed entry applied
+            self.synced_at = 0
+
+    def add(self, name):
+        with self._lock:
+            if name in self.names:
+                return
+            self.names.add(name)
+            key = name.lower()
+            for start in self._word_starts(key):
+                entry = (start != 0, len(name), name)
+                node = self.trie
+                for char in key[start:]:
+                    if node.best is None or entry < node.best:
+                        node.best = entry
+                    child = node.children.get(char)
+                    if child is None:
+                        child = node.children[char] = Node()
+                    node = child
+                if node.best is None or entry < node.best:
+                    node.best = entry
+                if node.entries is None:
+                    node.entries = set()
+                node.entries.add(entry)
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, set()).add(name)
+
+    def remove(self, name):
+        with self._lock:
+            if name not in self.names:
+                return
+            self.names.discard(name)
+            key = name.lower()
+            for start in self._word_starts(key):
+                self._remove_path(self.trie, key[start:], (start != 0, len(name), name))
+            for gram in trigrams(key):
+                self.grams[gram].discard(name)
+                if not self.grams[gram]:
+                    del self.grams[gram]
+
+    def _remove_path(self, node, suffix, entry):
+        if not suffix:
+            if node.entries:
+                node.entries.discard(entry)
+                if not node.entries:
+                    node.entries = None
+        else:
+            child = node.children.get(suffix[0])
+            if child is None:
+                return
+            self._remove_path(child, suffix[1:], entry)
+            if child.best is None:
+                del node.children[suffix[0]]
+        if node.best == entry:
+            node.update_best()
+
+    @staticmethod
+    def _word_starts(name):
+        return [0] + [i + 1 for i, char in enumerate(name) if char == ' ' and i + 1 < len(name)]
+
+    def prefix(self, text, limit):
+        """Returns up to limit names with a word starting with text, full name
+        matches first, then the shortest
+        """
+        with self._lock:
+            node = self.trie
+            for char in text:
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            # best first walk: a subtree is only opened when its best entry is next in line
+            order = itertools.count()
+            heap = [(node.best, next(order), node)]
+            found = []
+            while heap and len(found) < limit:
+                entry, _, current = heapq.heappop(heap)
+                if current is None:
+                    if entry[2] not in found:   # a name can match by several of its words
+                        found.append(entry[2])
+                    continue
+                for entry in current.entries or ():
+                    heapq.heappush(heap, (entry, next(order), None))
+                for child in current.children.values():
+                    heapq.heappush(heap, (child.best, next(order), child))
+        return found
+
+    def fuzzy(self, text, limit):
+        """Returns up to limit (name, distance) pairs for the names within a
+        couple of typos of text, closest first
+        """
+        bound = 1 if len(text) <= 4 else 2
+        shortest = len(text) - bound
+        with self._lock:
+            postings = sorted((self.grams[gram] for gram in trigrams(text) if gram in self.grams), key=len)
+            rare = [names for names in postings if len(names) <= MAX_POSTING]
+            if not rare and postings:
+                # all common ('bananna' in a store full of bananas): some of the names having the two rarest
+                narrowed = postings[0] & postings[1] if len(postings) > 1 else postings[0]
+                rare = [set(itertools.islice(narrowed or postings[0], MAX_POSTING))]
+            postings = rare
+            shared = {}
+            for names in postings:
+                for name in names:
+                    if len(name) >= shortest:
+                        shared[name] = shared.get(name, 0) + 1
+        # check the names sharing the most trigrams first, they are the likely matches
+        candidates = heapq.nlargest(MAX_CANDIDATES, shared, key=shared.get)
+        # the distance only depends on the beginning of the name
+        keys = {name: name.lower()[:len(text) + bound + 1] for name in candidates}
+        distances = typo_distances(text, set(keys.values()), bound)
+        matches = [(name, distances[key]) for name, key in keys.items() if distances[key] <= bound]
+        matches.sort(key=lambda match: (match[1], len(match[0]), match[0]))
+        return matches[:limit]
+
+    def search(self, text, limit=10):
+        """Prefix matches followed by the typo tolerant ones, when there are
+        fewer than limit prefix matches
+
+        Returns:
+            list: dictionaries with the name and how it matched
+        """
+        text = text.strip().lower()
+        if not text:
+            return []
+        self.sync()
+        results = [dict(name=name, match='prefix', distance=0) for name in self.prefix(text, limit)]
+        if len(results) >= limit:
+            return results
+        seen = {result['name'] for result in results}
+        for name, distance in self.fuzzy(text, limit):
+            if len(results) >= limit:
+                break
+            if name not in seen:
+                results.append(dict(name=name, match='fuzzy', distance=distance))
+        return results
+
+    def sync(self):
+        """Builds the index on first use, then applies the product creations and
+        deletions from the change feed at most every SEARCH_SYNC_INTERVAL seconds
+        """
+        now = time.monotonic()
+        if self.seq is not None and now - self.synced_at < current_app.config['SEARCH_SYNC_INTERVAL']:
+            return
+        with self._lock:
+            if self.seq is None:
+                self.seq = current_seq()
+                for name in db.session.scalars(select(Product.name)):
+                    self.add(name)
+            else:
+                query = select(Change.seq, Change.key, Change.op).where(
+                    Change.seq > self.seq, Change.entity == 'product', Change.op.in_(('create', 'delete')))
+                for seq, key, op in db.session.execute(query.order_by(Change.seq)):
+                    if op == 'create':
+                        self.add(key)
+                    else:
+                        self.remove(key)
+                    self.seq = seq
+            self.synced_at = now
+
+
+product_index = ProductIndex()
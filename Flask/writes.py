@@ -0,0 +1,136 @@
+"""Write operations of the API, run through group_commit.run by the views.
+
+They work on db.session but never commit, the caller does (see groupcommit.py).
+They answer like the views, an error is a (message, status) tuple and its
+changes are rolled back. The data they take has already been read from the
+request, they may run in another thread.
+"""
+from database import db
+from models import Product, Order, ProductsOrder, bump_catalog_version, record_changes, record_movements, update_pending_totals
+from quotes import is_current
+
+
+def create_product(name, price, quantity):
+    product = Product(name=name, price=price, quantity=quantity)
+    db.session.add(product)
+    record_movements([(product.name, quantity, 'import', None)])
+    record_changes([('product', product.name, 'create')])
+    bump_catalog_version()
+    return "Item added to the database", 200
+
+
+def update_product(name, new_price, new_quantity):
+    product = Product.query.filter(Product.name == name).first()
+    if product is None:
+        return "Product not found", 404
+    order_ids = []
+    if new_price and new_price != product.price:
+        product.price = new_price
+        db.session.flush()
+        order_ids = update_pending_totals(product.name)
+    if new_quantity:
+        record_movements([(product.name, new_quantity - product.quantity, 'adjustment', None)])
+        product.quantity = new_quantity
+    record_changes([('product', product.name, 'update')] + [('order', order_id, 'update') for order_id in order_ids])
+    bump_catalog_version()
+    return "Item was updated", 200
+
+
+def remove_product(name):
+    product = Product.query.filter(Product.name == name).first()
+    if product is None:
+        return "Product not found", 404
+    if ProductsOrder.query.filter(ProductsOrder.product_name == name).first():
+        return "Cannot remove product since it has been ordered by customers!", 400     # referential integrity in database must be kept
+    db.session.delete(product)
+    record_changes([('product', product.name, 'delete')])
+    bump_catalog_version()
+    return 'Product was removed', 200
+
+
+def create_order(name, address, completed, products, quote=None):
+    if quote is not None and is_current(quote, products):
+        # nothing changed since the quote, its products and prices still hold
+        order = Order(name=name, address=address, completed=completed, total=quote['price'])
+        for prod_name, prod_quant in quote['products']:
+            order.products.append(ProductsOrder(product_name=prod_name, quantity=prod_quant))
+        return add_order(order)
+    for item in products:
+        prod = item['name']
+        if not Product.query.get(item['name']):
+            return f'Product {prod} is not in the store', 404
+    order = Order(name=name, address=address, completed=completed)
+    for item in products:
+        product = Product.query.filter_by(name=item['name']).first()
+        if item['quantity'] > int(product.quantity):
+            return f"Insufficient inventory for product: {item['name']}", 400
+        prod_quant = item['quantity']
+        prod_name = item['name']
+        if (not isinstance(prod_quant, int)) or (isinstance(prod_quant, int) and int(prod_quant) < 0):
+            return f"Invalid quantity for {prod_name}, only non-negative int values accepted", 400
+        order_product = ProductsOrder(product=product, quantity=item['quantity'])
+        order.products.append(order_product)
+    order.update_total()
+    return add_order(order)
+
+
+def add_order(order):
+    db.session.add(order)
+    db.session.flush()      # assigns the order id
+    record_changes([('order', order.id, 'create')])
+    print(f'Order id: {order.id} was added!')
+    return order.to_dict(), 200
+
+
+def process_order(order_id):
+    order = Order.query.get(order_id)
+    if not order:
+        return "Order not found", 404
+    if order.completed is False:
+        order.process()
+    return order.to_dict(), 200
+
+
+def delete_order(order_id):
+    order = Order.query.get(order_id)
+    if not order:
+        return f"Order with id {order_id} does not exist!", 404
+    for item in order.products:
+        db.session.delete(item)
+    db.session.delete(order)
+    record_changes([('order', order_id, 'delete')])
+    return f"Order with id {order_id} was successfully removed", 200
+
+
+def update_order(order_id, product_list):
+    order = Order.query.filter_by(id=order_id).first()
+    if order is None:
+        return "Order not found", 400
+    for item in product_list:
+        prod_name = item['name']
+        if not Product.query.get(prod_name):
+            return f'Order not updated. Product {prod_name} is not in the database', 404
+        prod_quant = item['quantity']
+        if (not isinstance(prod_quant, int)) or (isinstance(prod_quant, int) and int(prod_quant) < 0):
+            return f"Invalid quantity for {prod_name}, only non-negative int values accepted", 400
+        if prod_quant > Product.query.get(prod_name).quantity:
+            return f"Insufficient inventory for product: {item['name']}", 400
+        product_order = None
+        for prod in order.products:
+            if prod.product_name == prod_name:
+                product_order = prod
+                break
+        if product_order:
+            if prod_quant != 0:
+                product_order.quantity = prod_quant
+            else:
+                db.session.delete(product_order)    # remove the ProductsOrder instance
+        else:
+            if prod_quant != 0:
+                new_products_order = ProductsOrder(product_name=prod_name, quantity=prod_quant)
+                order.products.append(new_products_order)
+    db.session.flush()
+    db.session.expire(order, ['products'])     # reload without the removed items
+    order.update_total()
+    record_changes([('order', order.id, 'update')])
+    return order.to_dict(), 200
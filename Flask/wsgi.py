@@ -0,0 +1,26 @@
+"""Production entry point for the ThriftMart API.
+
+Run it with gunicorn using the bundled configuration:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+`python app.py` is still the way to start the single process debug server.
+"""
+from sqlalchemy.orm import configure_mappers
+
+from app import app
+from database import db
+import models  # noqa: F401  (registers the mapped classes before the workers fork)
+
+# Resolve all relationships once in the master so that every forked worker
+# starts with the mappers already configured instead of doing it on its first request
+configure_mappers()
+
+
+def init_worker():
+    """Called in every worker right after the fork. The connection pool that
+    might have been created in the master must not be shared between processes,
+    so it's dropped here and each worker opens its own connections lazily.
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
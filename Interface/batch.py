@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy import LazyModule
+
+requests = LazyModule('requests')
+
+
+def fields(*names):
+    """Returns a function building the json body of a request from the given fields of an operation"""
+    return lambda op: {name: op.get(name) for name in names}
+
+
+# operation name -> (http method, function building the path, function building the json body)
+OPERATIONS = {
+    'create_order': ('POST', lambda op: '/api/order', fields('customer_name', 'customer_address', 'products')),
+    'update_order': ('PUT', lambda op: f"/api/order/{op['order_id']}", fields('products')),
+    'process_order': ('PUT', lambda op: f"/api/order/process/{op['order_id']}", lambda op: {'process': True}),
+    'delete_order': ('DELETE', lambda op: f"/api/order/delete/{op['order_id']}", lambda op: None),
+    'add_product': ('POST', lambda op: '/api/product', fields('name', 'price', 'quantity')),
+    'update_product': ('PUT', lambda op: f"/api/product/{op['name']}", fields('price', 'quantity')),
+    'delete_product': ('DELETE', lambda op: f"/api/product/{op['name']}", lambda op: None),
+}
+
+
+class BatchRunner:
+    """Class that runs the operations of a file against the API without any
+    prompt. Operations are sent concurrently by a bounded pool of workers that
+    share one keep alive connection pool, so they are not guaranteed to run in
+    the order of the file (put dependent operations in separate files).
+
+    The API rate limits the writes of a client on every route, the operations
+    of a kind are sent at most rate per second, and the ones refused with 429
+    or 503 are sent again after the Retry-After delay, up to attempts times.
+
+    The file has one JSON operation per line, e.g.:
+        {"op": "create_order", "customer_name": "Tim", "customer_address": "Vancouver", "products": [{"name": "apple", "quantity": 2}]}
+        {"op": "process_order", "order_id": 3}
+        {"op": "update_product", "name": "apple", "price": 1.49, "quantity": 100}
+    """
+    def __init__(self, screen, base_url='http://localhost:5001', workers=8, rate=5.0, attempts=5):
+        self.screen = screen
+        self.base_url = base_url
+        self.workers = workers
+        self.rate = rate    # operations per second of each kind, RATELIMIT_RATE of the server
+        self.attempts = attempts
+        self.next_send = {}     # operation name -> time.monotonic() of its next send
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def load(self, path):
+        """Method that reads the operations file, a line that is not a JSON
+        object is kept with the error so it's reported as a failed operation
+
+        Args:
+            path (str): path of the file
+
+        Returns:
+            list: (line number, operation dict, error message or None) tuples
+        """
+        operations = []
+        with open(path) as file:
+            for number, line in enumerate(file, start=1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    op = json.loads(line)
+                except json.JSONDecodeError as error:
+                    operations.append((number, {}, f'Invalid JSON: {error}'))
+                    continue
+                if isinstance(op, dict):
+                    operations.append((number, op, None))
+                else:
+                    operations.append((number, {}, 'Invalid operation: expected a JSON object'))
+        return operations
+
+    def execute(self, number, op, error=None):
+        """Method that sends one operation to the API
+
+        Args:
+            number (int): line of the operation in the file
+            op (dict): the operation
+            error (str, optional): why the line could not be read, nothing is sent then
+
+        Returns:
+            dict: line, op, ok, status and message of the result
+        """
+        result = dict(line=number, op=op.get('op'), ok=False, status=None)
+        if error:
+            result['message'] = error
+            return result
+        if op.get('op') not in OPERATIONS:
+            result['message'] = f"Unknown operation: {op.get('op')}"
+            return result
+        method, path, body = OPERATIONS[op['op']]
+        for attempt in range(self.attempts):
+            self.pace(op['op'])
+            try:
+                response = self.session.request(method, self.base_url + path(op), json=body(op))
+            except KeyError as error:
+                result['message'] = f'Missing field: {error}'
+                return result
+            except requests.exceptions.RequestException as error:
+                result['message'] = str(error)
+                return result
+            if response.status_code not in (429, 503) or attempt == self.attempts - 1:
+                break
+            time.sleep(self.retry_after(response))
+        result['status'] = response.status_code
+        result['ok'] = response.status_code == 200
+        result['message'] = self.summarize(response)
+        return result
+
+    def pace(self, name):
+        """Method that waits until an operation of this kind can be sent
+        without going over rate operations per second
+        """
+        with self.lock:
+            now = time.monotonic()
+            send = max(now, self.next_send.get(name, now))
+            self.next_send[name] = send + 1 / self.rate
+        time.sleep(send - now)
+
+    def retry_after(self, response):
+        """Method that returns the seconds to wait before sending a refused operation again"""
+        try:
+            return max(float(response.headers.get('Retry-After', 1)), 0)
+        except ValueError:  # an http date, not sent by the API
+            return 1
+
+    def summarize(self, response):
+        """Method that turns a response into a one line message for the report"""
+        if response.headers.get('Content-Type', '').startswith('application/json'):
+            data = response.json()
+            if isinstance(data, dict) and 'order_id' in data:
+                return f"order id: {data['order_id']}"
+        return response.text.strip().splitlines()[0][:200] if response.text.strip() else ''
+
+    def run(self, path):
+        """Method that runs all the operations of the file, prints the result of
+        every operation and the overall throughput
+
+        Args:
+            path (str): path of the operations file
+
+        Returns:
+            list: the results, in the order of the file
+        """
+        operations = self.load(path)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(lambda item: self.execute(*item), operations))
+        elapsed = time.perf_counter() - start
+        for result in results:
+            line = f"line {result['line']}: {result['op']} -> {result['status']} {result['message']}"
+            if result['ok']:
+                self.screen.print_success(line)
+            else:
+                self.screen.print_error(line)
+        succeeded = sum(result['ok'] for result in results)
+        rate = len(results) / elapsed if elapsed else 0
+        self.screen.print_message(f'{succeeded}/{len(results)} operations succeeded in {elapsed:.2f}s '
+                                  f'({rate:.1f} operations/s with {self.workers} workers)')
+        return results
@@ -0,0 +1,79 @@
+"""Measures how fast the terminal interface starts.
+
+    python benchmark.py --runs 10
+
+Every run is a fresh interpreter so the numbers include the cold imports:
+  * import: time to import the program module
+  * first menu: time from interpreter start until the main menu is printed
+    and the interface waits for the user's input
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_SNIPPET = '''
+import time
+start = time.perf_counter()
+import program
+print(time.perf_counter() - start)
+'''
+
+# The menu is considered shown as soon as the program asks for input, the
+# moment is compared to the time the process was launched (perf_counter is a
+# system wide monotonic clock on linux and mac)
+FIRST_MENU_SNIPPET = '''
+import builtins, os, sys, time
+import program
+
+
+class MenuShown(Exception):
+    pass
+
+
+def fake_input(*args):
+    raise MenuShown
+
+
+builtins.input = fake_input
+sys.stdout = open(os.devnull, 'w')
+try:
+    program.MainProgram().start()
+except MenuShown:
+    sys.stderr.write(str(time.perf_counter()))
+'''
+
+
+def run(snippet):
+    """Runs snippet in a new interpreter, returns the time it was launched and the finished process"""
+    launched = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', snippet], capture_output=True, text=True)
+    return launched, proc
+
+
+def median_ms(values):
+    return statistics.median(values) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    import_times = []
+    for _ in range(args.runs):
+        _, proc = run(IMPORT_SNIPPET)
+        import_times.append(float(proc.stdout))
+
+    menu_times = []
+    for _ in range(args.runs):
+        launched, proc = run(FIRST_MENU_SNIPPET)
+        menu_times.append(float(proc.stderr) - launched)
+
+    print(f'import program:    {median_ms(import_times):8.1f} ms (median of {args.runs})')
+    print(f'time to first menu:{median_ms(menu_times):8.1f} ms (median of {args.runs}, includes interpreter start)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """Stand-in for a module that is only imported the first time one of its
+    attributes is used, so heavy modules do not slow down the start of the interface
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Method that imports the module if it was not imported yet and returns it
+
+        Returns:
+            module: the real module
+        """
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+class LazySession(LazyModule):
+    """Stand-in for the requests.Session shared by the whole interface, created
+    the first time it is used. Going through one session keeps the cookies of the
+    server, e.g. the one that makes the reads see the writes just made
+    (see Flask/replica.py), and reuses the connection.
+    """
+    def __init__(self):
+        super().__init__('requests')
+        self._session = None
+
+    def load(self):
+        """Method that creates the session if it was not created yet and returns it
+
+        Returns:
+            requests.Session: the real session
+        """
+        if self._session is None:
+            requests = super().load()
+            with self._lock:
+                if self._session is None:
+                    self._session = requests.Session()
+        return self._session
+
+
+session = LazySession()
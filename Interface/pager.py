@@ -0,0 +1,98 @@
+from lazy import session
+
+
+class Pager:
+    """Class that shows a long list from the API one page at a time. Pages are
+    only requested when the user navigates to them and are kept once fetched.
+    """
+    def __init__(self, screen, url, render, per_page=20, title='', params=None):
+        """Constructor for the Pager
+
+        Args:
+            screen (Screen): screen used for printing
+            url (str): API endpoint returning a list and supporting ?page=&per_page=
+            render (function): function called with the items of the page to print them
+            per_page (int, optional): number of items on a page
+            title (str, optional): message printed above every page
+            params (dict, optional): extra query string arguments for the API
+        """
+        self.screen = screen
+        self.url = url
+        self.render = render
+        self.per_page = per_page
+        self.title = title
+        self.params = params or {}
+        self.pages = {}
+        self.total = None
+        self.page = 1
+
+    @property
+    def page_count(self):
+        return max((self.total + self.per_page - 1) // self.per_page, 1)
+
+    def fetch(self, page):
+        """Method that returns the items of a page, requesting it from the API
+        unless it was already fetched
+
+        Args:
+            page (int): page number, starting from 1
+
+        Returns:
+            list: the items, or None if the API answered with an error
+        """
+        if page not in self.pages:
+            response = session.get(self.url, params=dict(self.params, page=page, per_page=self.per_page))
+            if response.status_code != 200:
+                return None
+            self.total = int(response.headers.get('X-Total-Count', 0))
+            self.pages[page] = response.json()
+        return self.pages[page]
+
+    def navigate(self, choice):
+        """Method that moves to the page asked for by the user
+
+        Args:
+            choice (str): n (next), p (previous) or j <number> (jump)
+
+        Returns:
+            str: error message if the user can not move there, otherwise None
+        """
+        choice = choice.strip().lower()
+        if choice == 'n':
+            page = self.page + 1
+        elif choice == 'p':
+            page = self.page - 1
+        elif choice.startswith('j') and choice[1:].strip().isdigit():
+            page = int(choice[1:])
+        else:
+            return 'Invalid choice!'
+        if not 1 <= page <= self.page_count:
+            return f'Page {page} does not exist, there are {self.page_count} pages!'
+        self.page = page
+        return None
+
+    def run(self):
+        """Method that shows the first page and lets the user move between pages
+        until they quit
+
+        Returns:
+            boolean: False if there was nothing to show
+        """
+        if self.fetch(self.page) is None or not self.total:
+            return False
+        error = None
+        while True:
+            items = self.fetch(self.page)
+            self.screen.clear_screen()
+            self.screen.print_message(self.title)
+            if items is None:
+                self.screen.print_error('Could not load the page, please try again!')
+            else:
+                self.render(items)
+            if error:
+                self.screen.print_error(error)
+            self.screen.print_message(f'Page {self.page} of {self.page_count} ({self.total} in total)')
+            choice = self.screen.get_input('Enter [n] for next page, [p] for previous page, [j <number>] to jump to a page or [q] to return:')
+            if choice.strip().lower() == 'q':
+                return True
+            error = self.navigate(choice)
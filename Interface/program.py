@@ -1,8 +1,38 @@
-import requests
+import argparse
+import threading
+from lazy import LazyModule, session
 from screen import Screen
 from menu import Menu
+from pager import Pager
 import time
-from requests.exceptions import ConnectionError as RequestsConnectionError
+
+requests = LazyModule('requests')   # imported in the background by the health check, see HealthCheck
+
+
+class HealthCheck(threading.Thread):
+    """Thread that checks whether the Flask app is reachable while the menu is
+    already shown to the user, the result is only waited for once it is needed
+    """
+    def __init__(self, url):
+        super().__init__(daemon=True)
+        self.url = url
+        self.running = None
+
+    def run(self):
+        try:
+            requests.head(self.url, timeout=5)
+            self.running = True
+        except requests.exceptions.RequestException:
+            self.running = False
+
+    def is_running(self):
+        """Method that waits for the check to finish and returns its result
+
+        Returns:
+            boolean: True if the Flask app answered
+        """
+        self.join()
+        return self.running
 
 
 class Program:
@@ -13,6 +43,7 @@ class Program:
         self.menu = Menu()
         self.screen = Screen()
         self.prompt = ''
+        self.completions = []
 
     def quit(self):
         self.screen.clear_screen()
@@ -24,18 +55,69 @@ class Program:
         """Method that display the menu for the program, then takes user's choice and runs the option
         corresponding to the choice
         """
-        try:
-            response = requests.head('http://localhost:5001/')
-        except RequestsConnectionError:
-            self.screen.print_error('Flask app is not running, please run the app first!')
-            exit()
+        health_check = HealthCheck('http://localhost:5001/')
+        health_check.start()
         self.screen.clear_screen()
         while True:
             self.screen.print_message(self.prompt)
             self.screen.print_menu(self.menu)
-            if not self.menu.run(self.screen.get_input()):
+            choice = self.screen.get_input()
+            if not health_check.is_running():
+                self.screen.print_error('Flask app is not running, please run the app first!')
+                exit()
+            if not self.menu.run(choice):
                 break
 
+    def search_products(self, text, limit=10):
+        """Method that looks up product names matching text (by prefix or with
+        typos) with the product search of the API
+
+        Args:
+            text (str): what the user typed
+
+        Returns:
+            list: matching product names, or None if the search is not available
+        """
+        try:
+            response = session.get('http://localhost:5001/api/product/search', params={'q': text, 'limit': limit})
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return [match['name'] for match in response.json()]
+
+    def complete_product(self, text, state):
+        """readline completer for product names"""
+        if state == 0:
+            self.completions = self.search_products(text) or []
+        if state < len(self.completions):
+            return self.completions[state]
+        return None
+
+    def get_product_name(self, msg):
+        """Method that asks for a product name with Tab completion. If the name
+        is not a product the closest ones are suggested and the user is asked
+        again, entering the same name twice sends it as it is
+
+        Args:
+            msg (str): the prompt
+
+        Returns:
+            str: the product name
+        """
+        previous = None
+        while True:
+            name = self.screen.get_input(msg, completer=self.complete_product)
+            matches = self.search_products(name, limit=5)
+            if matches is None or name in matches or name == previous:
+                return name
+            if matches:
+                self.screen.print_error(f'There is no product called {name}, did you mean: {", ".join(matches)}?')
+            else:
+                self.screen.print_error(f'There is no product called {name}!')
+            self.screen.print_message('Enter the name again (Tab completes it), or the same name to use it anyway:')
+            previous = name
+
     def check_id(self, id):
         """Method that checks whether order id is a non-negative int number 
         and returns false if its not
@@ -142,35 +224,28 @@ class ManageProductsProgram(Program):
         self.prompt = 'Please choose from the following options to manage the products:'
 
     def view_all_products(self):
-        """Method that lets user view all the products in the store
+        """Method that lets user view all the products in the store, a page at a time
         """
         self.screen.clear_screen()
-        q = False
-        while not q:
-            self.screen.print_message('Products carried in store are:\n')
-            response = requests.get('http://localhost:5001/view-all-products')
-            if response.status_code == 200:
-                self.screen.print_message('Products in store are: ')
-                self.screen.print_products(response.json())
-            elif response.status_code == 404:
-                self.screen.print_message('We dont carry anything yet!')
-            self.screen.print_message('Enter [y/Y] to return to Products\'s menu:')
-            q = (self.screen.get_input().lower() == 'y')
+        widths = {}
+        pager = Pager(self.screen, 'http://localhost:5001/view-all-products',
+                      lambda products: self.screen.print_products(products, widths=widths),
+                      title='Products carried in store are:')
+        if not pager.run():
+            self.screen.print_message('We dont carry anything yet!')
+            self.screen.get_input('Press \'Return\' to return to Products\'s menu:')
 
     def view_out_of_stock(self):
         """Method that lets the user view all the products that are out of stock in the store
         """
         self.screen.clear_screen()
-        q = False
-        while not q:
-            response = requests.get('http://localhost:5001/api/product/not-in-stock')
-            if response.status_code == 200:
-                self.screen.print_message('Out of stocks products in store are:')
-                self.screen.print_products(response.json(), quant=False)
-            elif response.status_code == 404:
-                self.screen.print_message('All products are in stock now!')
-            self.screen.print_message('Enter [y/Y] to return to Products\'s menu:')
-            q = (self.screen.get_input().lower() == 'y')
+        widths = {}
+        pager = Pager(self.screen, 'http://localhost:5001/api/product/not-in-stock',
+                      lambda products: self.screen.print_products(products, quant=False, widths=widths),
+                      title='Out of stocks products in store are:')
+        if not pager.run():
+            self.screen.print_message('All products are in stock now!')
+            self.screen.get_input('Press \'Return\' to return to Products\'s menu:')
 
     def update_product(self):
         """Method that lets the user update existing product's price or quantity
@@ -193,7 +268,7 @@ class ManageProductsProgram(Program):
                 continue
             else:
                 quantity = int(quantity)
-            response = requests.put(f'http://localhost:5001/api/product/{name}', json={'price': price, 'quantity': quantity})
+            response = session.put(f'http://localhost:5001/api/product/{name}', json={'price': price, 'quantity': quantity})
             if response.status_code == 200:
                 success_msg = f'Product: {name} was updated:'
                 if price:
@@ -203,6 +278,8 @@ class ManageProductsProgram(Program):
                 self.screen.print_success(success_msg)
             elif response.status_code == 404:
                 self.screen.print_error(f'Product: {name} was not found!')
+            else:
+                self.screen.print_error(f'{response.text}, {response.status_code}')
             self.screen.print_message('Would you like to update another product?\nEnter [y/Y] if yes, otherwise enter any keys:')
             q = not (self.screen.get_input().lower() == 'y')
             
@@ -223,7 +300,7 @@ class ManageProductsProgram(Program):
                 continue    # check if quantity not valid ask for new product
             else:
                 quantity = int(quantity)
-            response = requests.post('http://localhost:5001/api/product', json={'name': name, 'price': price, 'quantity': quantity})
+            response = session.post('http://localhost:5001/api/product', json={'name': name, 'price': price, 'quantity': quantity})
             if response.status_code == 200:
                 self.screen.print_success(f'Product: {name} with price: {price} and quantity: {quantity} was added!')
             else:
@@ -240,13 +317,15 @@ class ManageProductsProgram(Program):
             name = self.screen.get_input('Please enter the name of product you would like to delete:')
             confirm = self.screen.get_input(f'Are you sure you would like delete product: {name}?\nEnter [y/Y] to confirm, else enter any value:')
             if confirm.lower() == 'y':
-                response = requests.delete(f'http://localhost:5001/api/product/{name}')
+                response = session.delete(f'http://localhost:5001/api/product/{name}')
                 if response.status_code == 200:
                     self.screen.print_success(f'Product: {name} was successfully deleted!')
                 elif response.status_code == 404:
                     self.screen.print_error(f'Product: {name} does not exist in the database!')
                 elif response.status_code == 400:
                     self.screen.print_error(f'Cannot delete {name}, since it has been ordered by customers!')
+                else:
+                    self.screen.print_error(f'{response.text}, {response.status_code}')
             self.screen.print_message('Would you like to delete another product?\nEnter [y/Y] if yes, otherwise enter any keys:')
             q = not (self.screen.get_input().lower() == 'y')
 
@@ -294,7 +373,7 @@ class ManageOrdersProgram(Program):
             if not self.check_id(id):
                 continue
             id = int(id)
-            response = requests.get(f'http://localhost:5001/api/order/{id}')
+            response = session.get(f'http://localhost:5001/api/order/{id}')
             if response.status_code == 200:
                 self.screen.print_message(f'Order with id: {id}:')
                 self.screen.print_order([response.json()])
@@ -311,45 +390,34 @@ class ManageOrdersProgram(Program):
         q = False
         while not q:
             partial_name = self.screen.get_input('Please enter name or partial name of the customer you would like to see orders of:')
-            response = requests.get(f'http://localhost:5001/api/order/user/{partial_name}')
-            if response.status_code == 200:
-                self.screen.print_message(f'Orders that partial match customer anme with {partial_name} are:')
-                self.screen.print_order(response.json())
-            if response.status_code == 404:
+            pager = Pager(self.screen, f'http://localhost:5001/api/order/user/{partial_name}', self.screen.print_order,
+                          per_page=5, title=f'Orders that partial match customer anme with {partial_name} are:')
+            if not pager.run():
                 self.screen.print_error(f'No order was matched with partial name: {partial_name}')
             self.screen.print_message('Would you like to view another customer\'s order?\nEnter [y/Y] if yes, otherwise enter any keys:')
             q = not (self.screen.get_input().lower() == 'y')
     
     def view_pending_orders(self):
         """Method that allows user view all the pending (no completed) orders in 
-        the database.
+        the database, a page at a time.
         """
         self.screen.clear_screen()
-        q = False
-        while not q:
-            response = requests.get('http://localhost:5001/api/order/pending')
-            if response.status_code == 200:
-                self.screen.print_message('Pending orders in store are:')
-                self.screen.print_order(response.json())
-            elif response.status_code == 404:
-                self.screen.print_error('There are no pending orders in the store!')
-            self.screen.print_message('Enter [y/Y] once you are done with reviewing pending orders:')
-            q = (self.screen.get_input().lower() == 'y')
+        fields = 'order_id,customer_name,customer_address,completed,order_date,price,products'  # pending orders have no process_date
+        pager = Pager(self.screen, 'http://localhost:5001/api/order/pending', self.screen.print_order,
+                      per_page=5, title='Pending orders in store are:', params={'fields': fields})
+        if not pager.run():
+            self.screen.print_error('There are no pending orders in the store!')
+            self.screen.get_input('Press \'Return\' to return to Orders\'s menu:')
 
     def view_processed_orders(self):
-        """Method that allows user to view processed orders in the database
+        """Method that allows user to view processed orders in the database, a page at a time
         """
         self.screen.clear_screen()
-        q = False
-        while not q:
-            response = requests.get('http://localhost:5001/api/order/processed')
-            if response.status_code == 200:
-                self.screen.print_message('Processed orders in the store are: ')
-                self.screen.print_order(response.json())
-            elif response.status_code == 404:
-                self.screen.print_error('There are no processed orders in the store!')
-            self.screen.print_message('Enter [y/Y] once you are done with reviewing processed orders:')
-            q = (self.screen.get_input().lower() == 'y')
+        pager = Pager(self.screen, 'http://localhost:5001/api/order/processed', self.screen.print_order,
+                      per_page=5, title='Processed orders in the store are:')
+        if not pager.run():
+            self.screen.print_error('There are no processed orders in the store!')
+            self.screen.get_input('Press \'Return\' to return to Orders\'s menu:')
 
     def delete_order(self):
         """Method that allows user to remove an order from teh database by 
@@ -367,7 +435,7 @@ class ManageOrdersProgram(Program):
                 self.screen.print_message('Would you like to delete another order?\nIf yes enter [y/Y], otherwise enter any key:')
                 q = not (self.screen.get_input().lower() == 'y')
                 continue    # if not confirmed ask for another id else got back to order menu
-            response = requests.delete(f'http://localhost:5001/api/order/delete/{id}')
+            response = session.delete(f'http://localhost:5001/api/order/delete/{id}')
             if response.status_code == 200:
                 self.screen.print_success(f'Order with id: {id} was removed!')
             elif response.status_code == 404:
@@ -388,11 +456,13 @@ class ManageOrdersProgram(Program):
                 continue
             id = int(id)
             process = {'process': True}
-            response = requests.put(f'http://localhost:5001/api/order/process/{id}', json=process)
+            response = session.put(f'http://localhost:5001/api/order/process/{id}', json=process)
             if response.status_code == 200:
                 self.screen.print_success(f'Order with id: {id} was processed successfully!')
             elif response.status_code == 404:
                 self.screen.print_error(f'Order with id: {id} does not exist!')
+            else:
+                self.screen.print_error(f'{response.text}, {response.status_code}')
             self.screen.print_message('Would you like to process another order?\nEnter [y\Y] if yes, otherwise enter any key:')
             q = not (self.screen.get_input().lower() == 'y')
             
@@ -408,7 +478,7 @@ class ManageOrdersProgram(Program):
             done = False
             prod_list = []
             while not done:     # get the products
-                prod_name = self.screen.get_input('Please enter the name of the product:')
+                prod_name = self.get_product_name('Please enter the name of the product:')
                 prod_quant = self.screen.get_input(f'Please enter the quantity of {prod_name}:')
                 if not self.check_quantity(prod_quant):
                     continue
@@ -419,14 +489,24 @@ class ManageOrdersProgram(Program):
                     continue
                 self.screen.print_message('Would you like to add another product to this order?\nEnter [y/Y] to add more products, otherwise enter any key:')
                 done = not (self.screen.get_input().lower() == 'y')
+            # price the order and check the stock before asking for the confirmation
+            quote = session.post('http://localhost:5001/api/order/quote', json={'products': prod_list})
+            if quote.status_code != 200:
+                self.screen.print_error(quote.content.decode())
+                self.screen.print_message('Would you like to create another order?\nEnter [y/Y] if yes, otherwise enter any key;')
+                q = not (self.screen.get_input().lower() == 'y')
+                continue
+            quote = quote.json()
             self.screen.print_message('You have entered the following order:')
-            self.screen.print_order([dict(customer_name=customer_name, customer_address=customer_address, products=prod_list)], display=False)
+            self.screen.print_order([dict(customer_name=customer_name, customer_address=customer_address,
+                                          products=quote['products'], price=quote['price'])], display=False)
             self.screen.print_message('Would you like to submit this order?\nEnter [y/Y] to submit, any other keys to discard:')
             if not (self.screen.get_input().lower() == 'y'):
                 self.screen.print_message('Would you like to make another order?, if yes enter [y/Y], else enter any other value: ')
                 if self.screen.get_input().lower() != 'y':
                     break
-            response = requests.post('http://localhost:5001/api/order', json={'customer_name': customer_name, 'customer_address': customer_address, 'products': prod_list})
+            response = session.post('http://localhost:5001/api/order', json={'customer_name': customer_name, 'customer_address': customer_address,
+                                                                              'products': prod_list, 'quote_token': quote['quote_token']})
             if response.status_code == 200:
                 id = response.json()['order_id']
                 self.screen.print_success(f'Your order with id: {id} was successfully submitted!')
@@ -434,6 +514,8 @@ class ManageOrdersProgram(Program):
                 self.screen.print_error(response.content.decode())
             elif response.status_code == 400:  # User can not order quantities larger than in-stock quantities
                 self.screen.print_error(response.content.decode())
+            else:
+                self.screen.print_error(f'{response.text}, {response.status_code}')
             self.screen.print_message('Would you like to create another order?\nEnter [y/Y] if yes, otherwise enter any key;')
             q = not (self.screen.get_input().lower() == 'y')
     
@@ -449,7 +531,7 @@ class ManageOrdersProgram(Program):
             if not self.check_id(ord_id):
                 continue
             ord_id = int(ord_id)
-            response = requests.get(f'http://localhost:5001/api/order/{ord_id}')
+            response = session.get(f'http://localhost:5001/api/order/{ord_id}')
             if response.status_code == 200:
                 self.screen.print_message(f'Order with id {ord_id} is:')
                 self.screen.print_order([response.json()], display=False)   # display order to user
@@ -465,7 +547,7 @@ class ManageOrdersProgram(Program):
             prod_list = []
             while not done:     # get the list of products to update
                 self.screen.print_message('You can update a product, add a product, or remove a product from the order by entering 0 for quantity!')
-                prod_name = self.screen.get_input('Please enter the name of product you would like to update/add/delete:')
+                prod_name = self.get_product_name('Please enter the name of product you would like to update/add/delete:')
                 prod_quant = self.screen.get_input(f'Please enter the new quantity for {prod_name}:')
                 if not self.check_quantity(prod_quant):
                     continue
@@ -477,13 +559,15 @@ class ManageOrdersProgram(Program):
                     done = not (self.screen.get_input().lower() == 'y')
                 else:
                     continue
-            response = requests.put(f'http://localhost:5001/api/order/{ord_id}', json={'products': prod_list})
+            response = session.put(f'http://localhost:5001/api/order/{ord_id}', json={'products': prod_list})
             if response.status_code == 200:
                 self.screen.print_success(f'Order with id: {ord_id} was successfully updated')
             elif response.status_code == 404:   # product(s) not in the database
                 self.screen.print_error(response.content.decode())
             elif response.status_code == 400:   # User can not order quantities larger than in-stock quantities
                 self.screen.print_error(response.content.decode())
+            else:
+                self.screen.print_error(f'{response.text}, {response.status_code}')
             self.screen.print_message('Would you like to update another order?\nEnter [y/Y], else enter any other value: ')
             q = not (self.screen.get_input().lower() == 'y')      
     
@@ -502,5 +586,14 @@ class ManageOrdersProgram(Program):
         
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Thrift Mart terminal interface')
+    parser.add_argument('--batch', metavar='FILE', help='run the operations in FILE (one JSON object per line) without prompts')
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent requests in batch mode')
+    parser.add_argument('--rate', type=float, default=5.0, help='operations per second of each kind in batch mode, the rate limit of the API')
+    args = parser.parse_args()
+    if args.batch:
+        from batch import BatchRunner   # concurrent.futures is only imported for the batch mode
+        results = BatchRunner(Screen(), workers=args.workers, rate=args.rate).run(args.batch)
+        exit(0 if all(result['ok'] for result in results) else 1)
     main_program = MainProgram()
     main_program.start()    # start the program with the main menu here
\ No newline at end of file
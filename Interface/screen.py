@@ -1,6 +1,14 @@
-import os
+import shutil
 from colorama import Fore, Style, init
-from tabulate import tabulate
+from lazy import LazyModule
+
+try:
+    import readline     # line editing and tab completion, not available on Windows
+except ImportError:
+    readline = None
+
+tabulate = LazyModule('tabulate')
+CLEAR_SCREEN = '\033[2J\033[H'    # erase the display and move the cursor home
 
 
 class Screen:
@@ -12,23 +20,42 @@ class Screen:
     def clear_screen(self):
         """Method that clears the screen
         """
-        if os.name == 'nt':  # check os here
-            os.system('cls')
-        else:
-            os.system('clear')
+        print(CLEAR_SCREEN, end='', flush=True)   # colorama translates it on Windows
+
+    def terminal_width(self):
+        return shutil.get_terminal_size().columns
 
-    def print_line(self):
+    def print_line(self, width=None):
         """Method that prints a line |====| with length as wide as the 
         terminal size
+
+        Args:
+            width (int, optional): width of the terminal if already known
         """
-        terminal_size = os.get_terminal_size().columns
-        line = '|' + (terminal_size - 2) * '=' + '|'
+        if width is None:
+            width = self.terminal_width()
+        line = '|' + (width - 2) * '=' + '|'
         print(line)
         print()
 
-    def get_input(self, msg=''):
+    def get_input(self, msg='', completer=None):
+        """Method that prints msg in cyan and returns what the user enters
+
+        Args:
+            msg (str, optional): the prompt
+            completer (function, optional): readline completer used when the user presses Tab
+        """
         print(Fore.CYAN + Style.BRIGHT + msg + Style.RESET_ALL + '\n')
-        arg = input()
+        if readline is None or completer is None:
+            arg = input()
+        else:
+            readline.set_completer_delims('')   # complete the whole line, product names have spaces
+            readline.parse_and_bind('tab: complete')
+            readline.set_completer(completer)
+            try:
+                arg = input()
+            finally:
+                readline.set_completer(None)
         print()
         return arg
 
@@ -74,32 +101,63 @@ class Screen:
         # print(message)
         print()
     
-    def print_products(self, products_list, quant=True):
+    def print_products(self, products_list, quant=True, widths=None):
         """Method that receives a list of products dictionaries and prints 
         them into the screen, includes the quantities if quant value is True
 
         Args:
             products_list (list): list of product dictionaries
             quant (bool, optional): if true method prints the quantities as well
+            widths (dict, optional): column widths kept between calls, see print_table
         """
         if not quant:
-            for prod in products_list:
-                prod.pop('quantity')
-        print(tabulate(products_list, headers='keys'))
+            products_list = [{key: value for key, value in prod.items() if key != 'quantity'} for prod in products_list]
+        if widths is None:
+            print(tabulate.tabulate(products_list, headers='keys'))
+        else:
+            self.print_table(products_list, widths)
         print()
 
+    def print_table(self, rows, widths):
+        """Method that prints a list of dictionaries as a table. Column widths
+        are stored in widths and only grow, so when it's passed again for the
+        next page only the new rows are measured and the columns stay aligned
+
+        Args:
+            rows (list): list of dictionaries with the same keys
+            widths (dict): column name -> width, updated in place
+        """
+        if not rows:
+            return
+        columns = list(rows[0].keys())
+        for column in columns:
+            widest = max(len(str(row[column])) for row in rows)
+            widths[column] = max(widths.get(column, len(column)), widest)
+        print('  '.join(column.ljust(widths[column]) for column in columns))
+        print('  '.join('-' * widths[column] for column in columns))
+        for row in rows:
+            cells = []
+            for column in columns:
+                value = row[column]
+                if isinstance(value, (int, float)):
+                    cells.append(str(value).rjust(widths[column]))
+                else:
+                    cells.append(str(value).ljust(widths[column]))
+            print('  '.join(cells))
+
     def print_order(self, order_list, display=True):
         """Method that receives an order dictionary, rearranges the items in it
         then prints it into the screen, if display is true, prints more 
         information about the order, including, order_id, completed, order_date
-        process_date and price
+        process_date and price. The price is also printed when the order has one
 
         Args:
             order_list (dict): an order
             display (bool, optional): if True method prints more information
         """
+        width = self.terminal_width()
         for order in order_list:
-            self.print_line()
+            self.print_line(width)
             order_rearranged = {}
             if display:
                 order_rearranged['order_id'] = order['order_id']
@@ -108,14 +166,14 @@ class Screen:
             if display:
                 order_rearranged['completed'] = order['completed']
                 order_rearranged['order_date'] = order['order_date']
-                if order['process_date']:
+                if order.get('process_date'):
                     order_rearranged['process_date'] = order['process_date']
-            if display:
+            if display or 'price' in order:     # orders not submitted yet have a price once quoted
                 order_rearranged['price'] = order['price']
-            print(tabulate(order_rearranged.items(), headers=[]))
+            print(tabulate.tabulate(order_rearranged.items(), headers=[]))
             print()
             print('Products:')
             print()
-            print(tabulate(order['products'], headers='keys'))
+            print(tabulate.tabulate(order['products'], headers='keys'))
         print()
-        self.print_line()  
+        self.print_line(width)